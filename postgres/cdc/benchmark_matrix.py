@@ -0,0 +1,138 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+from typing import List, Literal, Optional, TypedDict
+
+from benchmark_update import (
+    END_DATE,
+    MARKET_ID,
+    SERVER_COUNTERS,
+    START_DATE,
+    run_update_benchmark,
+)
+from common import get_engine, print_log
+import pandas as pd
+
+
+class BenchmarkCell(TypedDict):
+    cell_id: int
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"]
+    method: str
+    table_size: Optional[int]
+    fillfactor: Optional[int]
+    autovacuum: Optional[bool]
+    market_id: str
+    start_date: str
+    end_date: str
+    nb_versions: int
+
+
+def build_matrix(
+    scenarios: List[str],
+    methods: List[str],
+    table_sizes: Optional[List[Optional[int]]] = None,
+    fillfactors: Optional[List[Optional[int]]] = None,
+    autovacuum: Optional[List[Optional[bool]]] = None,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    nb_versions: int = 15,
+) -> List[BenchmarkCell]:
+    return [
+        {
+            "cell_id": cell_id,
+            "scenario": scenario,
+            "method": method,
+            "table_size": table_size,
+            "fillfactor": fillfactor,
+            "autovacuum": autovacuum_enabled,
+            "market_id": market_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "nb_versions": nb_versions,
+        }
+        for cell_id, (
+            scenario,
+            method,
+            table_size,
+            fillfactor,
+            autovacuum_enabled,
+        ) in enumerate(
+            itertools.product(
+                scenarios,
+                methods,
+                table_sizes or [None],
+                fillfactors or [None],
+                autovacuum or [None],
+            )
+        )
+    ]
+
+
+def run_cell(cell: BenchmarkCell) -> pd.DataFrame:
+    # each cell works on its own clone of orders, over its own connection
+    print_log(f"Run cell {cell}")
+    engine = get_engine()
+    with engine.connect() as connection:
+        df = run_update_benchmark(
+            connection,
+            cell["scenario"],
+            cell["method"],
+            market_id=cell["market_id"],
+            start_date=cell["start_date"],
+            end_date=cell["end_date"],
+            nb_versions=cell["nb_versions"],
+            test_table=f"orders_matrix_{cell['cell_id']}",
+            table_size=cell["table_size"],
+            fillfactor=cell["fillfactor"],
+            autovacuum=cell["autovacuum"],
+        )
+    engine.dispose()
+
+    df = df.rename_axis("nth_update").reset_index()
+    for key, value in cell.items():
+        df[key] = value
+    return df
+
+
+def run_benchmark_matrix(
+    cells: List[BenchmarkCell],
+    max_workers: Optional[int] = 4,
+    output: Optional[str] = "result/benchmark_matrix.csv",
+    server_counters: Optional[bool] = False,
+) -> pd.DataFrame:
+    # WAL, checkpoint and pg_stat_io counters are server-wide: a cell would also count
+    # the work of the cells running next to it. With server_counters the cells run one
+    # after the other, otherwise they run in parallel and those counters are dropped.
+    # Keep max_workers below the number of cores the database can give to the benchmark
+    if server_counters:
+        df = pd.concat(map(run_cell, cells), ignore_index=True)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            df = pd.concat(executor.map(run_cell, cells), ignore_index=True)
+        df = df.drop(columns=SERVER_COUNTERS, errors="ignore")
+
+    if output.endswith(".parquet"):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+    print_log(f"Saved {len(cells)} cells to {output}")
+    return df
+
+
+if __name__ == "__main__":
+    run_benchmark_matrix(
+        build_matrix(
+            scenarios=["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+            methods=[
+                "replace",
+                "incremental",
+                "client_diff",
+                "merge",
+                "incremental_hashed",
+                "partition_swap",
+            ],
+            fillfactors=[100, 80],
+            autovacuum=[False, True],
+        ),
+        max_workers=4,
+    )
@@ -1,9 +1,24 @@
+from datetime import datetime, timedelta
 import time
-from typing import Literal, TypedDict
+from typing import Dict, List, Literal, Optional, TypedDict
 
-from common import connect_db, get_engine, print_log
+from common import (
+    connect_db,
+    copy_df_to_table,
+    copy_file_to_table,
+    create_staging_table,
+    get_engine,
+    print_log,
+)
 import pandas as pd
 from sqlalchemy import text
+from stats_sampler import StatsSampler
+
+
+MARKET_ID = "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c"
+START_DATE = "2024-01-01"
+END_DATE = "2024-01-31"
+ORDER_COLUMNS = "market_id, order_id, date, total_price, nb_items"
 
 
 class Stats(TypedDict):
@@ -16,173 +31,976 @@ class Stats(TypedDict):
     n_tuples_updated: float
     n_tuples_hot_updated: float
     n_tuples_deleted: float
+    heap_blks_read: float
+    heap_blks_hit: float
+    idx_blks_read: float
+    idx_blks_hit: float
+    wal_lsn_bytes: float
+    wal_records: Optional[float]
+    wal_fpi: Optional[float]
+    wal_buffers_full: Optional[float]
+    checkpoints: float
+    io_writes: Optional[float]
+    io_fsyncs: Optional[float]
+    relations: Dict[int, dict]
+
+
+# cumulative counters of each relation, reported as after - before for each update
+RELATION_COUNTERS = [
+    "heap_blks_read",
+    "heap_blks_hit",
+    "idx_blks_read",
+    "idx_blks_hit",
+    "n_tuples_updated",
+    "n_tuples_hot_updated",
+]
+# counters of the whole server, they also count the work of concurrent sessions
+SERVER_COUNTERS = [
+    "wal_lsn_bytes",
+    "wal_records",
+    "wal_fpi",
+    "wal_buffers_full",
+    "checkpoints",
+    "io_writes",
+    "io_fsyncs",
+]
+
+
+def capture_server_stats(connection, version: int) -> dict:
+    # pg_stat_wal needs PostgreSQL 14+, pg_stat_io 16+, checkpoints moved to
+    # pg_stat_checkpointer in 17
+    stats = {
+        "wal_lsn_bytes": connection.execute(
+            text("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')::int8")
+        ).scalar(),
+        "wal_records": None,
+        "wal_fpi": None,
+        "wal_buffers_full": None,
+        "io_writes": None,
+        "io_fsyncs": None,
+    }
+    if version >= 140000:
+        stats.update(
+            connection.execute(
+                text("SELECT wal_records, wal_fpi, wal_buffers_full FROM pg_stat_wal")
+            )
+            .mappings()
+            .one()
+        )
+    if version >= 170000:
+        checkpoints_sql = "SELECT num_timed + num_requested FROM pg_stat_checkpointer"
+    else:
+        checkpoints_sql = (
+            "SELECT checkpoints_timed + checkpoints_req FROM pg_stat_bgwriter"
+        )
+    stats["checkpoints"] = connection.execute(text(checkpoints_sql)).scalar()
+    if version >= 160000:
+        stats.update(
+            connection.execute(
+                text(
+                    """SELECT
+                    COALESCE(SUM(writes), 0)::int8 AS "io_writes",
+                    COALESCE(SUM(fsyncs), 0)::int8 AS "io_fsyncs"
+                    FROM pg_stat_io
+                    WHERE backend_type = 'client backend'"""
+                )
+            )
+            .mappings()
+            .one()
+        )
+    return stats
 
 
 def capture_stats(
-    connection, table_name: str, before_or_after: Literal["before", "after"]
+    connection,
+    table_name: str,
+    before_or_after: Literal["before", "after"],
+    extra_relations: Optional[List[str]] = None,
 ) -> Stats:
     if before_or_after == "after":
         current_time = time.time()
 
+    version = connection.execute(
+        text("SELECT current_setting('server_version_num')::int")
+    ).scalar()
+    # a backend flushes its pending counters when it goes idle outside a transaction,
+    # and from PostgreSQL 15 at most once a second unless the next flush is forced.
+    # The commit lets the flush happen before the statistics are read
+    if version >= 150000:
+        connection.execute(text("SELECT pg_stat_force_next_flush()"))
+    connection.commit()
+    # statistics views are cached for the whole transaction otherwise
+    connection.execute(text("SELECT pg_stat_clear_snapshot()"))
     stats = connection.execute(
         text(
             f"""
         SELECT
-            (pg_relation_size(relid)) AS "heap_size",
-            (pg_indexes_size(relid)) AS "index_size",
-            n_live_tup AS "n_live_tuples",
-            n_dead_tup AS "n_dead_tuples",
-            n_tup_ins AS "n_tuples_inserted",
-            n_tup_upd AS "n_tuples_updated",
-            n_tup_hot_upd AS "n_tuples_hot_updated",
-            n_tup_del AS "n_tuples_deleted"
+            SUM(pg_relation_size(t.relid))::int8 AS "heap_size",
+            SUM(pg_indexes_size(t.relid))::int8 AS "index_size",
+            SUM(n_live_tup)::int8 AS "n_live_tuples",
+            SUM(n_dead_tup)::int8 AS "n_dead_tuples",
+            SUM(n_tup_ins)::int8 AS "n_tuples_inserted",
+            SUM(n_tup_upd)::int8 AS "n_tuples_updated",
+            SUM(n_tup_hot_upd)::int8 AS "n_tuples_hot_updated",
+            SUM(n_tup_del)::int8 AS "n_tuples_deleted",
+            SUM(io.heap_blks_read)::int8 AS "heap_blks_read",
+            SUM(io.heap_blks_hit)::int8 AS "heap_blks_hit",
+            COALESCE(SUM(io.idx_blks_read), 0)::int8 AS "idx_blks_read",
+            COALESCE(SUM(io.idx_blks_hit), 0)::int8 AS "idx_blks_hit"
             FROM
             pg_stat_user_tables t
+            JOIN pg_statio_user_tables io ON io.relid = t.relid
             WHERE
-            t.relname = '{table_name}';
+            t.relid = '{table_name}'::regclass
+            OR t.relid IN (
+                SELECT relid FROM pg_partition_tree('{table_name}') WHERE isleaf
+            );
         """
         )
     )
     stats_dict = stats.mappings().all()[0]
+    # the same counters per relation: leaves can be dropped or attached between two
+    # snapshots, extra_relations adds tables that are not part of table_name yet
+    relations = connection.execute(
+        text(
+            f"""
+        SELECT
+            t.relid,
+            n_tup_upd AS "n_tuples_updated",
+            n_tup_hot_upd AS "n_tuples_hot_updated",
+            io.heap_blks_read,
+            io.heap_blks_hit,
+            COALESCE(io.idx_blks_read, 0) AS "idx_blks_read",
+            COALESCE(io.idx_blks_hit, 0) AS "idx_blks_hit"
+            FROM
+            pg_stat_user_tables t
+            JOIN pg_statio_user_tables io ON io.relid = t.relid
+            WHERE
+            t.relid = '{table_name}'::regclass
+            OR t.relid IN (
+                SELECT relid FROM pg_partition_tree('{table_name}') WHERE isleaf
+            )
+            OR t.relid = ANY(CAST(:extra_relations AS regclass[]));
+        """
+        ),
+        {"extra_relations": extra_relations or []},
+    ).mappings()
+    stats_dict = {
+        **stats_dict,
+        "relations": {row["relid"]: dict(row) for row in relations},
+    }
+    server_stats = capture_server_stats(connection, version)
 
     if before_or_after == "before":
         current_time = time.time()
 
-    return {"current_time": current_time, **stats_dict}
+    return {"current_time": current_time, **stats_dict, **server_stats}
+
+
+def delta_counters(before: Stats, after: Stats) -> dict:
+    # relation counters are only compared on the relations of both snapshots: a
+    # partition dropped in between would otherwise take its whole history away
+    relids = before["relations"].keys() & after["relations"].keys()
+    deltas = {
+        counter: sum(
+            after["relations"][relid][counter] - before["relations"][relid][counter]
+            for relid in relids
+        )
+        for counter in RELATION_COUNTERS
+    }
+    for counter in SERVER_COUNTERS:
+        if after[counter] is not None:
+            deltas[counter] = after[counter] - before[counter]
+    return deltas
+
+
+class StepStats(TypedDict):
+    step: str
+    exec_time: float
+    shared_blks_hit: Optional[int]
+    shared_blks_read: Optional[int]
+    local_blks_hit: Optional[int]
+    local_blks_read: Optional[int]
+    wal_bytes: Optional[int]
 
 
-def load_data_to_tmp_table(engine, tmp_table_name: str, file: str):
+EXPLAIN_COUNTERS = {
+    "shared_blks_hit": "Shared Hit Blocks",
+    "shared_blks_read": "Shared Read Blocks",
+    "local_blks_hit": "Local Hit Blocks",
+    "local_blks_read": "Local Read Blocks",
+    "wal_bytes": "WAL Bytes",
+}
+
+
+class StepRecorder:
+    # times each statement of an update and, with explain, runs the DML ones through
+    # EXPLAIN ANALYZE to get their buffer and WAL counters. EXPLAIN ANALYZE executes
+    # the statement, so it is run once either way
+    def __init__(self, explain: Optional[bool] = False):
+        self.explain = explain
+        self.steps: List[StepStats] = []
+
+    def execute(self, connection, step: str, sql: str):
+        explainable = sql.split(None, 1)[0].upper() in (
+            "SELECT",
+            "INSERT",
+            "UPDATE",
+            "DELETE",
+            "MERGE",
+        )
+        counters = {key: None for key in EXPLAIN_COUNTERS}
+        start = time.perf_counter()
+        if self.explain and explainable:
+            plan = connection.execute(
+                text(f"EXPLAIN (ANALYZE, BUFFERS, WAL, TIMING OFF, FORMAT JSON) {sql}")
+            ).scalar()[0]["Plan"]
+            counters = {
+                key: plan.get(name, 0) for key, name in EXPLAIN_COUNTERS.items()
+            }
+        else:
+            connection.execute(text(sql))
+        self.steps.append(
+            {"step": step, "exec_time": time.perf_counter() - start, **counters}
+        )
+
+    def record(self, step: str, exec_time: float):
+        self.steps.append(
+            {
+                "step": step,
+                "exec_time": exec_time,
+                **{key: None for key in EXPLAIN_COUNTERS},
+            }
+        )
+
+    def to_columns(self) -> dict:
+        # one step_<name>_time column per step and, for explained steps, one
+        # step_<name>_<counter> column per buffer and WAL counter. The counters are
+        # also summed over the steps
+        columns = {}
+        for step in self.steps:
+            column = f"step_{step['step']}_time"
+            columns[column] = columns.get(column, 0) + step["exec_time"]
+            for key in EXPLAIN_COUNTERS:
+                if step[key] is not None:
+                    column = f"step_{step['step']}_{key}"
+                    columns[column] = columns.get(column, 0) + step[key]
+                    columns[key] = columns.get(key, 0) + step[key]
+        return columns
+
+
+def execute_step(connection, recorder: Optional[StepRecorder], step: str, sql: str):
+    if recorder is None:
+        connection.execute(text(sql))
+    else:
+        recorder.execute(connection, step, sql)
+
+
+def commit_step(connection, recorder: Optional[StepRecorder]):
+    start = time.perf_counter()
+    connection.commit()
+    if recorder is not None:
+        recorder.record("commit", time.perf_counter() - start)
+
+
+def load_data_to_tmp_table(
+    connection,
+    tmp_table_name: str,
+    file: str,
+    like_table: str,
+    unlogged: Optional[bool] = True,
+    storage_parameters: Optional[List[str]] = None,
+):
     df = pd.read_csv(file, parse_dates=[2])
-    df.to_sql(
-        tmp_table_name, con=engine, if_exists="replace", index=False, method="multi"
+    dbapi_connection = connection.connection
+    create_staging_table(
+        dbapi_connection.cursor(),
+        tmp_table_name,
+        like_table,
+        unlogged,
+        storage_parameters,
     )
+    copy_df_to_table(dbapi_connection, df, tmp_table_name, log=True)
+    dbapi_connection.commit()
 
 
-def update_by_replace(connection, table_name: str, tmp_table_name: str):
-    connection.execute(
-        text(
-            f"DELETE FROM {table_name} WHERE market_id = '84834db8-c1b4-4e09-90cd-8bae1b4a3f0c' AND date >= '2024-01-01' AND date <= '2024-01-31'"
-        )
+def stream_csv_to_tmp_table(
+    connection,
+    tmp_table_name: str,
+    file: str,
+    like_table: str,
+    unlogged: Optional[bool] = True,
+    storage_parameters: Optional[List[str]] = None,
+):
+    dbapi_connection = connection.connection
+    create_staging_table(
+        dbapi_connection.cursor(),
+        tmp_table_name,
+        like_table,
+        unlogged,
+        storage_parameters,
     )
-    connection.execute(text(f"INSERT INTO {table_name} SELECT * FROM {tmp_table_name}"))
-    connection.commit()
+    copy_file_to_table(dbapi_connection, file, tmp_table_name, log=True)
+    dbapi_connection.commit()
+
+
+def update_by_replace(
+    connection,
+    table_name: str,
+    tmp_table_name: str,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    recorder: Optional[StepRecorder] = None,
+):
+    execute_step(
+        connection,
+        recorder,
+        "delete",
+        f"DELETE FROM {table_name} WHERE market_id = '{market_id}' AND date >= '{start_date}' AND date <= '{end_date}'",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "insert",
+        f"INSERT INTO {table_name} ({ORDER_COLUMNS}) SELECT {ORDER_COLUMNS} FROM {tmp_table_name}",
+    )
+    commit_step(connection, recorder)
 
 
-def update_incremental(connection, table_name: str, tmp_table_name: str):
+def update_incremental(
+    connection,
+    table_name: str,
+    tmp_table_name: str,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    recorder: Optional[StepRecorder] = None,
+):
     compare_table_name = f"{tmp_table_name}_compare"
-    connection.execute(
-        text(
-            f"CREATE TEMPORARY TABLE {compare_table_name} (LIKE {table_name} INCLUDING ALL, fingerprint varchar);"
-        )
+    execute_step(
+        connection,
+        recorder,
+        "create_compare_table",
+        f"CREATE TEMPORARY TABLE {compare_table_name} (LIKE {table_name} INCLUDING ALL, fingerprint varchar);",
     )
-    connection.execute(
-        text(
-            f"INSERT INTO {compare_table_name} SELECT * FROM {table_name} WHERE date >= '2024-01-01' AND date <= '2024-01-31'"
-        )
+    execute_step(
+        connection,
+        recorder,
+        "copy_compare_table",
+        f"INSERT INTO {compare_table_name} SELECT * FROM {table_name} WHERE market_id = '{market_id}' AND date >= '{start_date}' AND date <= '{end_date}'",
     )
-    connection.execute(
-        text(f"ALTER TABLE {tmp_table_name} ADD COLUMN fingerprint varchar;")
+    execute_step(
+        connection,
+        recorder,
+        "add_fingerprint",
+        f"ALTER TABLE {tmp_table_name} ADD COLUMN fingerprint varchar;",
     )
-    connection.execute(
-        text(
-            f"UPDATE {tmp_table_name} SET fingerprint = CONCAT(total_price,'-',nb_items)"
-        )
+    execute_step(
+        connection,
+        recorder,
+        "fingerprint_tmp",
+        f"UPDATE {tmp_table_name} SET fingerprint = CONCAT(total_price,'-',nb_items)",
     )
-    connection.execute(
-        text(
-            f"UPDATE {compare_table_name} SET fingerprint = CONCAT(total_price,'-',nb_items)"
-        )
+    execute_step(
+        connection,
+        recorder,
+        "fingerprint_compare",
+        f"UPDATE {compare_table_name} SET fingerprint = CONCAT(total_price,'-',nb_items)",
     )
 
-    connection.execute(
-        text(
-            f"""DELETE FROM {table_name} WHERE order_id IN (
+    execute_step(
+        connection,
+        recorder,
+        "delete",
+        f"""DELETE FROM {table_name} WHERE order_id IN (
                 SELECT comp.order_id order_id FROM {compare_table_name} comp
                 LEFT JOIN {tmp_table_name} tmp
                 ON comp.order_id = tmp.order_id
                 WHERE tmp.order_id IS NULL
-            ) """
-        )
+            ) """,
     )
-    connection.execute(
-        text(
-            f"""INSERT INTO {table_name} 
+    execute_step(
+        connection,
+        recorder,
+        "upsert",
+        f"""INSERT INTO {table_name} 
         SELECT tmp.market_id, tmp.order_id, tmp.date, tmp.total_price, tmp.nb_items FROM {tmp_table_name} tmp 
         LEFT JOIN {compare_table_name} comp 
         ON tmp.order_id = comp.order_id
         WHERE comp.order_id IS NULL 
         OR tmp.fingerprint != comp.fingerprint
         ON CONFLICT (order_id) DO UPDATE
-        SET total_price = EXCLUDED.total_price, nb_items = EXCLUDED.nb_items;"""
+        SET total_price = EXCLUDED.total_price, nb_items = EXCLUDED.nb_items;""",
+    )
+    commit_step(connection, recorder)
+
+
+def update_merge(
+    connection,
+    table_name: str,
+    tmp_table_name: str,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    recorder: Optional[StepRecorder] = None,
+):
+    # needs PostgreSQL 15+. Keys missing from the file are removed by a companion
+    # DELETE, as WHEN NOT MATCHED BY SOURCE only exists from PostgreSQL 17
+    execute_step(
+        connection,
+        recorder,
+        "delete",
+        f"""DELETE FROM {table_name} t
+            WHERE t.market_id = '{market_id}' AND t.date >= '{start_date}' AND t.date <= '{end_date}'
+            AND NOT EXISTS (SELECT 1 FROM {tmp_table_name} tmp WHERE tmp.order_id = t.order_id)""",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "merge",
+        f"""MERGE INTO {table_name} t
+        USING {tmp_table_name} tmp
+        ON t.order_id = tmp.order_id
+        WHEN MATCHED AND (
+            t.total_price IS DISTINCT FROM tmp.total_price
+            OR t.nb_items IS DISTINCT FROM tmp.nb_items
+        ) THEN
+            UPDATE SET total_price = tmp.total_price, nb_items = tmp.nb_items
+        WHEN NOT MATCHED THEN
+            INSERT ({ORDER_COLUMNS})
+            VALUES (tmp.market_id, tmp.order_id, tmp.date, tmp.total_price, tmp.nb_items);""",
+    )
+    commit_step(connection, recorder)
+
+
+def row_hash_expression(alias: Optional[str] = None) -> str:
+    prefix = f"{alias}." if alias else ""
+    return f"md5({prefix}total_price::text || '-' || {prefix}nb_items::text)"
+
+
+def update_incremental_hashed(
+    connection,
+    table_name: str,
+    tmp_table_name: str,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    recorder: Optional[StepRecorder] = None,
+):
+    # the target keeps its hashes in the stored row_hash column (see clone_table),
+    # so only the staging rows are hashed
+    execute_step(
+        connection,
+        recorder,
+        "delete",
+        f"""DELETE FROM {table_name} t
+            WHERE t.market_id = '{market_id}' AND t.date >= '{start_date}' AND t.date <= '{end_date}'
+            AND NOT EXISTS (SELECT 1 FROM {tmp_table_name} tmp WHERE tmp.order_id = t.order_id)""",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "upsert",
+        f"""INSERT INTO {table_name} ({ORDER_COLUMNS})
+        SELECT tmp.market_id, tmp.order_id, tmp.date, tmp.total_price, tmp.nb_items FROM {tmp_table_name} tmp
+        LEFT JOIN {table_name} cur
+        ON tmp.order_id = cur.order_id
+        WHERE cur.order_id IS NULL
+        OR cur.row_hash IS DISTINCT FROM {row_hash_expression("tmp")}
+        ON CONFLICT (order_id) DO UPDATE
+        SET total_price = EXCLUDED.total_price, nb_items = EXCLUDED.nb_items;""",
+    )
+    commit_step(connection, recorder)
+
+
+def market_partition_name(table_name: str, market_id: str) -> str:
+    return f"{table_name}_{market_id.replace('-', '')[:12]}"
+
+
+def month_partition_name(table_name: str, market_id: str, month_start: str) -> str:
+    return f"{market_partition_name(table_name, market_id)}_{month_start[:7].replace('-', '')}"
+
+
+def next_month_start(month_start: str) -> str:
+    date = datetime.strptime(month_start, "%Y-%m-%d")
+    return (
+        (date.replace(day=28) + timedelta(days=4)).replace(day=1).strftime("%Y-%m-%d")
+    )
+
+
+def update_partition_swap(
+    connection,
+    table_name: str,
+    tmp_table_name: str,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    recorder: Optional[StepRecorder] = None,
+):
+    # the staging table becomes the new (market, month) partition: no row is
+    # deleted or updated in place, so there are no dead tuples to vacuum
+    market_partition = market_partition_name(table_name, market_id)
+    month_partition = month_partition_name(table_name, market_id, start_date)
+    month_end = next_month_start(start_date)
+
+    # lets ATTACH PARTITION skip its validation scan
+    execute_step(
+        connection,
+        recorder,
+        "add_bounds",
+        f"""ALTER TABLE {tmp_table_name} ADD CONSTRAINT {tmp_table_name}_bounds
+            CHECK (market_id = '{market_id}' AND date >= '{start_date}' AND date < '{month_end}')""",
+    )
+    exists = connection.execute(
+        text(f"SELECT to_regclass('{month_partition}') IS NOT NULL")
+    ).scalar()
+    if exists:
+        execute_step(
+            connection,
+            recorder,
+            "detach",
+            f"ALTER TABLE {market_partition} DETACH PARTITION {month_partition}",
+        )
+        execute_step(connection, recorder, "drop", f"DROP TABLE {month_partition}")
+    execute_step(
+        connection,
+        recorder,
+        "rename",
+        f"ALTER TABLE {tmp_table_name} RENAME TO {month_partition}",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "attach",
+        f"ALTER TABLE {market_partition} ATTACH PARTITION {month_partition} FOR VALUES FROM ('{start_date}') TO ('{month_end}')",
+    )
+    commit_step(connection, recorder)
+
+
+UPDATE_METHODS = {
+    "replace": update_by_replace,
+    "incremental": update_incremental,
+    "merge": update_merge,
+    "incremental_hashed": update_incremental_hashed,
+    "partition_swap": update_partition_swap,
+}
+
+
+def compute_row_hashes(df: pd.DataFrame) -> pd.Series:
+    # one uint64 hash of the payload per order, keyed by order_id
+    return pd.Series(
+        pd.util.hash_pandas_object(
+            df[["total_price", "nb_items"]], index=False
+        ).to_numpy(),
+        index=df["order_id"].to_numpy(),
+    )
+
+
+def load_row_hashes(
+    connection,
+    table_name: str,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+) -> pd.Series:
+    result = connection.execute(
+        text(
+            f"SELECT order_id, total_price, nb_items FROM {table_name} WHERE market_id = '{market_id}' AND date >= '{start_date}' AND date <= '{end_date}'"
         )
     )
+    df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
     connection.commit()
+    return compute_row_hashes(df)
+
+
+def update_client_diff(
+    connection,
+    table_name: str,
+    tmp_table_name: str,
+    df: pd.DataFrame,
+    snapshot: pd.Series,
+    recorder: Optional[StepRecorder] = None,
+) -> pd.Series:
+    # diff against the previous version's hashes locally, send only the changed keys
+    diff_start = time.perf_counter()
+    hashes = compute_row_hashes(df)
+    previous = snapshot.reindex(hashes.index, fill_value=0).to_numpy()
+    is_new = ~hashes.index.isin(snapshot.index)
+    is_changed = is_new | (previous != hashes.to_numpy())
+    deleted = pd.DataFrame({"order_id": snapshot.index.difference(hashes.index)})
+    if recorder is not None:
+        recorder.record("client_diff", time.perf_counter() - diff_start)
+
+    deleted_table_name = f"{tmp_table_name}_deleted"
+    execute_step(
+        connection,
+        recorder,
+        "drop_staging_table",
+        f"DROP TABLE IF EXISTS {tmp_table_name}",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "create_staging_table",
+        f"CREATE UNLOGGED TABLE {tmp_table_name} (LIKE {table_name})",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "create_deleted_table",
+        f"CREATE TEMPORARY TABLE {deleted_table_name} (order_id varchar)",
+    )
+    changed_copy = copy_df_to_table(
+        connection.connection, df[is_changed], tmp_table_name
+    )
+    deleted_copy = copy_df_to_table(connection.connection, deleted, deleted_table_name)
+    if recorder is not None:
+        recorder.record("copy", changed_copy["exec_time"] + deleted_copy["exec_time"])
+
+    execute_step(
+        connection,
+        recorder,
+        "delete",
+        f"DELETE FROM {table_name} t USING {deleted_table_name} d WHERE t.order_id = d.order_id",
+    )
+    execute_step(
+        connection,
+        recorder,
+        "upsert",
+        f"""INSERT INTO {table_name} ({ORDER_COLUMNS})
+        SELECT {ORDER_COLUMNS} FROM {tmp_table_name}
+        ON CONFLICT (order_id) DO UPDATE
+        SET total_price = EXCLUDED.total_price, nb_items = EXCLUDED.nb_items;""",
+    )
+    commit_step(connection, recorder)
+    print_log(
+        f"Client diff: {is_new.sum()} inserted, {is_changed.sum() - is_new.sum()} changed, {len(deleted.index)} deleted"
+    )
+
+    return hashes
 
 
 def test_update_data(
     scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
-    method: Literal["replace", "incremental"],
+    method: Literal[
+        "replace",
+        "incremental",
+        "client_diff",
+        "merge",
+        "incremental_hashed",
+        "partition_swap",
+    ],
+    load_mode: Literal["dataframe", "stream"] = "stream",
+    explain: Optional[bool] = False,
+    sample_interval: Optional[float] = None,
 ):
     print_log(f"Test update data using {method} method")
+    engine = get_engine()
+    connection = engine.connect()
+
+    try:
+        df_result = run_update_benchmark(
+            connection,
+            scenario,
+            method,
+            load_mode,
+            explain=explain,
+            sample_interval=sample_interval,
+            samples_file=f"result/{scenario}/samples_{method}.parquet",
+        )
+        df_result.to_csv(f"result/{scenario}/result_update_data_{method}.csv")
+    except Exception as e:
+        print(e)
+        connection.rollback()
+
+
+def run_update_benchmark(
+    connection,
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+    method: Literal[
+        "replace",
+        "incremental",
+        "client_diff",
+        "merge",
+        "incremental_hashed",
+        "partition_swap",
+    ],
+    load_mode: Literal["dataframe", "stream"] = "stream",
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    end_date: str = END_DATE,
+    nb_versions: int = 15,
+    test_table: Optional[str] = None,
+    table_size: Optional[int] = None,
+    fillfactor: Optional[int] = None,
+    autovacuum: Optional[bool] = None,
+    explain: Optional[bool] = False,
+    sample_interval: Optional[float] = None,
+    samples_file: Optional[str] = None,
+    indexed_columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
     stats = []
+    samples = []
     files = [
-        f"./data/{scenario}/order_84834db8-c1b4-4e09-90cd-8bae1b4a3f0c_2024-01.csv",
+        f"./data/{scenario}/order_{market_id}_{start_date[:7]}.csv",
     ] + [
-        f"./data/{scenario}/order_84834db8-c1b4-4e09-90cd-8bae1b4a3f0c_2024-01_updated_{i}.csv"
-        for i in range(1, 15)
+        f"./data/{scenario}/order_{market_id}_{start_date[:7]}_updated_{i}.csv"
+        for i in range(1, nb_versions)
     ]
-    func = update_by_replace if method == "replace" else update_incremental
-    engine = get_engine()
-    connection = engine.connect()
-    test_table = f"orders_test_{method}"
-    clone_table(connection, "orders", test_table)
+    data_slice = {
+        "market_id": market_id,
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    func = UPDATE_METHODS.get(method)
+    load_func = (
+        stream_csv_to_tmp_table if load_mode == "stream" else load_data_to_tmp_table
+    )
+    test_table = test_table or f"orders_test_{method}"
+    clone_table(
+        connection,
+        "orders",
+        test_table,
+        with_row_hash=method == "incremental_hashed",
+        partitioned=method == "partition_swap",
+        table_size=table_size,
+        fillfactor=fillfactor,
+        autovacuum=autovacuum,
+        market_id=market_id,
+        start_date=start_date,
+        indexed_columns=indexed_columns,
+    )
 
-    try:
-        for i in range(len(files)):
-            print_log(f"Update data {i + 1}")
-            tmp_table = f"_tmp_{test_table}_{i}"
-            load_data_to_tmp_table(engine, tmp_table, files[i])
-
-            before = capture_stats(connection, test_table, "before")
-            if i == 0:
-                stats.append(
-                    {
-                        "heap_size": before["heap_size"],
-                        "index_size": before["index_size"],
-                        "n_dead_tuples": before["n_dead_tuples"],
-                    }
-                )
-            func(connection, test_table, tmp_table)
-            after = capture_stats(connection, test_table, "after")
+    if method == "client_diff":
+        snapshot = load_row_hashes(connection, test_table, **data_slice)
+    # the swapped-in staging table replaces a leaf partition: it is created with the
+    # storage parameters clone_table gave to the leaves
+    swap_storage_parameters = (
+        storage_parameters(fillfactor, autovacuum)
+        if method == "partition_swap"
+        else None
+    )
 
+    for i in range(len(files)):
+        print_log(f"Update data {i + 1}")
+        tmp_table = f"_tmp_{test_table}_{i}"
+        load_start = time.time()
+        if method == "client_diff":
+            df = pd.read_csv(files[i], parse_dates=[2])
+        else:
+            # a swapped-in staging table becomes live data, so it must be logged
+            load_func(
+                connection,
+                tmp_table,
+                files[i],
+                test_table,
+                unlogged=method != "partition_swap",
+                storage_parameters=swap_storage_parameters,
+            )
+        load_time = time.time() - load_start
+
+        recorder = StepRecorder(explain)
+        # the staging table of partition_swap becomes a leaf during the update: it is
+        # in the before snapshot, so what the swap does to it is counted
+        before = capture_stats(
+            connection,
+            test_table,
+            "before",
+            extra_relations=[tmp_table] if method == "partition_swap" else None,
+        )
+        if i == 0:
             stats.append(
                 {
-                    "exec_time": after["current_time"] - before["current_time"],
-                    "heap_size": after["heap_size"],
-                    "index_size": after["index_size"],
-                    "n_dead_tuples": after["n_dead_tuples"],
+                    "heap_size": before["heap_size"],
+                    "index_size": before["index_size"],
+                    "n_dead_tuples": before["n_dead_tuples"],
                 }
             )
+        if sample_interval:
+            sampler = StatsSampler(test_table, sample_interval)
+            sampler.start()
+        try:
+            if method == "client_diff":
+                snapshot = update_client_diff(
+                    connection, test_table, tmp_table, df, snapshot, recorder=recorder
+                )
+            else:
+                func(connection, test_table, tmp_table, **data_slice, recorder=recorder)
+        finally:
+            # a failing update must not leave the sampler thread polling the server
+            if sample_interval:
+                samples.append(sampler.stop().assign(nth_update=i + 1))
+        after = capture_stats(connection, test_table, "after")
 
-        df_result = pd.DataFrame(stats)
-        df_result.to_csv(f"result/{scenario}/result_update_data_{method}.csv")
-    except Exception as e:
-        print(e)
-        connection.rollback()
+        stats.append(
+            {
+                "load_time": load_time,
+                "exec_time": after["current_time"] - before["current_time"],
+                "heap_size": after["heap_size"],
+                "index_size": after["index_size"],
+                "n_dead_tuples": after["n_dead_tuples"],
+                **delta_counters(before, after),
+                **recorder.to_columns(),
+            }
+        )
 
+    if samples and samples_file:
+        pd.concat(samples, ignore_index=True).to_parquet(samples_file, index=False)
+    return pd.DataFrame(stats)
 
-def clone_table(connection, source_table, target_table):
+
+def clone_table(
+    connection,
+    source_table,
+    target_table,
+    with_row_hash: Optional[bool] = False,
+    partitioned: Optional[bool] = False,
+    table_size: Optional[int] = None,
+    fillfactor: Optional[int] = None,
+    autovacuum: Optional[bool] = None,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+    indexed_columns: Optional[List[str]] = None,
+):
     connection.execute(text(f"DROP TABLE IF EXISTS {target_table}"))
-    connection.execute(text(f"CREATE TABLE {target_table} AS TABLE {source_table};"))
-    connection.execute(text(f"ALTER TABLE {target_table} ADD PRIMARY KEY (order_id);"))
+    # table_size keeps the rows of the updated (market, month) first, so the versions
+    # always find the orders they change, then the other rows in order_id order
+    source = (
+        f"""(SELECT * FROM {source_table}
+            ORDER BY market_id = '{market_id}'
+                AND date >= '{start_date}' AND date < '{next_month_start(start_date)}' DESC,
+                order_id
+            LIMIT {table_size}) source"""
+        if table_size
+        else source_table
+    )
+    if partitioned:
+        create_partitioned_table(
+            connection, source_table, target_table, market_id, start_date
+        )
+    else:
+        connection.execute(
+            text(
+                f"CREATE TABLE {target_table} AS SELECT * FROM {source_table} WITH NO DATA;"
+            )
+        )
+    # fillfactor only applies to pages written afterwards, so set it before loading
+    if fillfactor is not None or autovacuum is not None:
+        set_storage_parameters(connection, target_table, fillfactor, autovacuum)
+    connection.execute(text(f"INSERT INTO {target_table} SELECT * FROM {source}"))
+    # the primary key of a partitioned table must contain the partition keys
+    connection.execute(
+        text(
+            f"ALTER TABLE {target_table} ADD PRIMARY KEY ({'order_id, market_id, date' if partitioned else 'order_id'});"
+        )
+    )
+    if with_row_hash:
+        connection.execute(
+            text(
+                f"ALTER TABLE {target_table} ADD COLUMN row_hash text GENERATED ALWAYS AS ({row_hash_expression()}) STORED;"
+            )
+        )
+        connection.execute(
+            text(f"CREATE INDEX ON {target_table} (order_id, row_hash);")
+        )
+    for column in indexed_columns or []:
+        connection.execute(text(f"CREATE INDEX ON {target_table} ({column});"))
     connection.commit()
     connection.execute(text(f"ANALYZE {target_table};"))
     connection.commit()
 
 
-test_update_data(scenario="low_diff_ratio", method="replace")
-test_update_data(scenario="low_diff_ratio", method="incremental")
-test_update_data(scenario="medium_diff_ratio", method="replace")
-test_update_data(scenario="medium_diff_ratio", method="incremental")
-test_update_data(scenario="high_diff_ratio", method="replace")
-test_update_data(scenario="high_diff_ratio", method="incremental")
+def storage_parameters(
+    fillfactor: Optional[int] = None, autovacuum: Optional[bool] = None
+) -> List[str]:
+    parameters = []
+    if fillfactor is not None:
+        parameters.append(f"fillfactor = {fillfactor}")
+    if autovacuum is not None:
+        parameters.append(f"autovacuum_enabled = {'on' if autovacuum else 'off'}")
+    return parameters
+
+
+def set_storage_parameters(
+    connection,
+    table_name: str,
+    fillfactor: Optional[int] = None,
+    autovacuum: Optional[bool] = None,
+):
+    # partitioned tables take no storage parameters, set them on each leaf partition
+    parameters = storage_parameters(fillfactor, autovacuum)
+    relations = connection.execute(
+        text(
+            f"""SELECT relid::text FROM pg_partition_tree('{table_name}') WHERE isleaf
+            UNION ALL
+            SELECT '{table_name}' WHERE NOT EXISTS (
+                SELECT 1 FROM pg_partition_tree('{table_name}')
+            )"""
+        )
+    ).scalars()
+    for relation in relations.all():
+        connection.execute(
+            text(f"ALTER TABLE {relation} SET ({', '.join(parameters)});")
+        )
+
+
+def create_partitioned_table(
+    connection,
+    source_table,
+    target_table,
+    market_id: str = MARKET_ID,
+    start_date: str = START_DATE,
+):
+    # list partitioned by market_id, each market range partitioned by month
+    connection.execute(
+        text(
+            f"CREATE TABLE {target_table} (LIKE {source_table}) PARTITION BY LIST (market_id);"
+        )
+    )
+    months = connection.execute(
+        text(
+            f"""SELECT DISTINCT market_id, to_char(date_trunc('month', date), 'YYYY-MM-DD') AS month_start
+            FROM {source_table}
+            UNION
+            SELECT '{market_id}', '{start_date[:7]}-01'
+            ORDER BY market_id, month_start"""
+        )
+    ).all()
+    for partition_market_id in sorted({row[0] for row in months}):
+        connection.execute(
+            text(
+                f"""CREATE TABLE {market_partition_name(target_table, partition_market_id)}
+                PARTITION OF {target_table} FOR VALUES IN ('{partition_market_id}')
+                PARTITION BY RANGE (date);"""
+            )
+        )
+    for partition_market_id, month_start in months:
+        connection.execute(
+            text(
+                f"""CREATE TABLE {month_partition_name(target_table, partition_market_id, month_start)}
+                PARTITION OF {market_partition_name(target_table, partition_market_id)}
+                FOR VALUES FROM ('{month_start}') TO ('{next_month_start(month_start)}');"""
+            )
+        )
+
+
+if __name__ == "__main__":
+    test_update_data(scenario="low_diff_ratio", method="replace")
+    test_update_data(scenario="low_diff_ratio", method="incremental")
+    test_update_data(scenario="low_diff_ratio", method="client_diff")
+    test_update_data(scenario="low_diff_ratio", method="merge")
+    test_update_data(scenario="low_diff_ratio", method="incremental_hashed")
+    test_update_data(scenario="low_diff_ratio", method="partition_swap")
+    test_update_data(scenario="medium_diff_ratio", method="replace")
+    test_update_data(scenario="medium_diff_ratio", method="incremental")
+    test_update_data(scenario="medium_diff_ratio", method="client_diff")
+    test_update_data(scenario="medium_diff_ratio", method="merge")
+    test_update_data(scenario="medium_diff_ratio", method="incremental_hashed")
+    test_update_data(scenario="medium_diff_ratio", method="partition_swap")
+    test_update_data(scenario="high_diff_ratio", method="replace")
+    test_update_data(scenario="high_diff_ratio", method="incremental")
+    test_update_data(scenario="high_diff_ratio", method="client_diff")
+    test_update_data(scenario="high_diff_ratio", method="merge")
+    test_update_data(scenario="high_diff_ratio", method="incremental_hashed")
+    test_update_data(scenario="high_diff_ratio", method="partition_swap")
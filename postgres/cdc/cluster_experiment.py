@@ -0,0 +1,235 @@
+from datetime import datetime
+import json
+import os
+import random
+import time
+from typing import List, Optional
+
+from common import connect_db, print_log
+from generate_data import (
+    build_orders_by_date,
+    load_order_data_test_index_correlation,
+    quarter_ranges,
+)
+import numpy as np
+import pandas as pd
+
+
+LOOKUP_SQL = "SELECT * FROM {table_name} WHERE market_id = %s"
+
+
+def capture_correlation(cursor, table_name: str, column: str) -> float:
+    cursor.execute(f"ANALYZE {table_name};")
+    cursor.execute(
+        """SELECT correlation FROM pg_stats
+        WHERE tablename = %s AND attname = %s AND NOT inherited""",
+        (table_name, column),
+    )
+    return cursor.fetchone()[0]
+
+
+def capture_sizes(cursor, table_name: str) -> dict:
+    cursor.execute(
+        f"""SELECT
+            pg_relation_size('{table_name}') AS heap_size,
+            pg_relation_size('{table_name}_market_id_idx') AS btree_size,
+            coalesce(pg_relation_size(to_regclass('{table_name}_market_id_brin')), 0) AS brin_size"""
+    )
+    return dict(zip(["heap_size", "btree_size", "brin_size"], cursor.fetchone()))
+
+
+def measure_lookups(
+    cursor, table_name: str, market_ids: List[str], nb_runs: int = 3
+) -> dict:
+    # the first run of each lookup warms the cache, the median of the next nb_runs is kept.
+    # hit + read blocks is the number of pages touched, whatever the cache state
+    sql = LOOKUP_SQL.format(table_name=table_name)
+    runs = []
+    for market_id in market_ids:
+        results = []
+        for _ in range(nb_runs + 1):
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", (market_id,)
+            )
+            result = cursor.fetchone()[0]
+            result = json.loads(result) if isinstance(result, str) else result
+            results.append(result[0])
+        plan = results[-1]["Plan"]
+        runs.append(
+            {
+                "execution_time": np.median(
+                    [result["Execution Time"] for result in results[1:]]
+                ),
+                "buffers": plan["Shared Hit Blocks"] + plan["Shared Read Blocks"],
+                "rows": plan["Actual Rows"],
+                "node_type": plan["Node Type"],
+            }
+        )
+    df = pd.DataFrame(runs)
+    return {
+        "lookup_time": df["execution_time"].median(),
+        "lookup_time_p95": df["execution_time"].quantile(0.95),
+        "lookup_buffers": df["buffers"].median(),
+        "lookup_rows": df["rows"].median(),
+        "node_type": df["node_type"].mode()[0],
+    }
+
+
+def measure_brin_lookups(
+    cursor, table_name: str, market_ids: List[str], nb_runs: int = 3
+) -> dict:
+    # the btree is dropped inside a transaction that is rolled back, so the planner
+    # can only pick the BRIN index for the lookups
+    cursor.execute("BEGIN;")
+    cursor.execute(f"DROP INDEX {table_name}_market_id_idx;")
+    try:
+        return measure_lookups(cursor, table_name, market_ids, nb_runs)
+    finally:
+        cursor.execute("ROLLBACK;")
+
+
+def cluster_table(cursor, table_name: str) -> float:
+    start = time.perf_counter()
+    cursor.execute(f"CLUSTER {table_name} USING {table_name}_market_id_idx;")
+    cluster_time = time.perf_counter() - start
+    cursor.execute(f"ANALYZE {table_name};")
+    return cluster_time
+
+
+def capture_stage(
+    cursor,
+    table_name: str,
+    stage: str,
+    market_ids: List[str],
+    nb_runs: int,
+    brin: Optional[bool] = False,
+) -> dict:
+    measure = measure_brin_lookups if brin else measure_lookups
+    stats = {
+        "stage": stage,
+        "market_id_correlation": capture_correlation(cursor, table_name, "market_id"),
+        "date_correlation": capture_correlation(cursor, table_name, "date"),
+        **capture_sizes(cursor, table_name),
+        **measure(cursor, table_name, market_ids, nb_runs),
+    }
+    print_log(
+        f"{stage}: correlation(market_id)={stats['market_id_correlation']:.3f}, {stats['node_type']} {stats['lookup_time']:.2f} ms, {stats['lookup_buffers']:.0f} buffers"
+    )
+    return stats
+
+
+def run_cluster_experiment(
+    table_name: str = "orders_by_date_cluster",
+    nb_markets: int = 1000,
+    nb_orders_per_day: int = 5,
+    start_date: datetime = datetime(2022, 1, 1),
+    nb_quarters: int = 8,
+    nb_appended_quarters: int = 4,
+    nb_lookups: int = 20,
+    nb_runs: int = 3,
+    seed: int = 0,
+    output: Optional[str] = "result/cluster/cluster_experiment.csv",
+) -> pd.DataFrame:
+    connection = connect_db()
+    connection.autocommit = True
+    cursor = connection.cursor()
+    quarters = quarter_ranges(start_date, nb_quarters + nb_appended_quarters)
+
+    market_ids = build_orders_by_date(
+        table_name, nb_markets, nb_orders_per_day, start_date, nb_quarters
+    )
+    cursor.execute(
+        f"CREATE INDEX {table_name}_market_id_idx ON {table_name} (market_id);"
+    )
+    lookup_ids = random.Random(seed).sample(market_ids, min(nb_lookups, nb_markets))
+
+    stages = [capture_stage(cursor, table_name, "loaded", lookup_ids, nb_runs)]
+    cluster_time = cluster_table(cursor, table_name)
+    stages.append(capture_stage(cursor, table_name, "clustered", lookup_ids, nb_runs))
+    stages[-1]["cluster_time"] = cluster_time
+    cursor.execute(
+        f"CREATE INDEX {table_name}_market_id_brin ON {table_name} USING brin (market_id);"
+    )
+    stages.append(
+        capture_stage(cursor, table_name, "brin", lookup_ids, nb_runs, brin=True)
+    )
+
+    # new quarters arrive in date order after the CLUSTER: the rows of a market spread
+    # again. At each step a copy of the table is clustered to get the re-CLUSTER time
+    # and the lookup cost it would bring back
+    for i, (quarter_start, quarter_end) in enumerate(quarters[nb_quarters:]):
+        load_order_data_test_index_correlation(
+            table_name, market_ids, nb_orders_per_day, quarter_start, quarter_end
+        )
+        stage = f"appended_{i + 1}"
+        stats = capture_stage(cursor, table_name, stage, lookup_ids, nb_runs)
+        stats["nb_appended_quarters"] = i + 1
+
+        copy_name = f"{table_name}_recluster"
+        cursor.execute(f"DROP TABLE IF EXISTS {copy_name};")
+        cursor.execute(f"CREATE TABLE {copy_name} AS SELECT * FROM {table_name};")
+        cursor.execute(
+            f"CREATE INDEX {copy_name}_market_id_idx ON {copy_name} (market_id);"
+        )
+        stats["recluster_time"] = cluster_table(cursor, copy_name)
+        reclustered = measure_lookups(cursor, copy_name, lookup_ids, nb_runs)
+        stats["reclustered_lookup_time"] = reclustered["lookup_time"]
+        stats["reclustered_lookup_buffers"] = reclustered["lookup_buffers"]
+        cursor.execute(f"DROP TABLE {copy_name};")
+        stages.append(stats)
+    connection.close()
+
+    df = pd.DataFrame(stages)
+    df["nb_markets"] = nb_markets
+    df["nb_orders_per_day"] = nb_orders_per_day
+    if output:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        df.to_csv(output, index=False)
+    return df
+
+
+def estimate_recluster_payback(
+    df: pd.DataFrame, lookups_per_day: float, days_per_quarter: float = 91
+) -> pd.DataFrame:
+    # a re-CLUSTER costs its run time (the table is locked meanwhile) and saves the gap
+    # between the decayed and the freshly clustered lookup time on every later lookup.
+    # It pays for itself once the time saved over the next quarter exceeds its cost
+    df = df[df["stage"].str.startswith("appended_")].copy()
+    df["saved_time_per_lookup"] = (
+        df["lookup_time"] - df["reclustered_lookup_time"]
+    ) / 1000
+    df["payback_lookups"] = df["recluster_time"] / df["saved_time_per_lookup"].where(
+        df["saved_time_per_lookup"] > 0
+    )
+    df["payback_days"] = df["payback_lookups"] / lookups_per_day
+    df["pays_off_within_quarter"] = df["payback_days"] <= days_per_quarter
+    paying = df[df["pays_off_within_quarter"]]
+    if paying.empty:
+        print_log(
+            f"With {lookups_per_day:g} lookups per day, re-CLUSTER never pays off within a quarter"
+        )
+    else:
+        print_log(
+            f"With {lookups_per_day:g} lookups per day, re-CLUSTER every {paying['nb_appended_quarters'].iloc[0]:.0f} quarter(s)"
+        )
+    return df[
+        [
+            "nb_appended_quarters",
+            "market_id_correlation",
+            "lookup_time",
+            "reclustered_lookup_time",
+            "recluster_time",
+            "payback_lookups",
+            "payback_days",
+            "pays_off_within_quarter",
+        ]
+    ]
+
+
+if __name__ == "__main__":
+    df_cluster = run_cluster_experiment()
+    print(
+        estimate_recluster_payback(df_cluster, lookups_per_day=10_000).to_string(
+            index=False
+        )
+    )
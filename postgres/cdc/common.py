@@ -1,6 +1,10 @@
+import io
 import os
+import time
+from typing import List, Optional, TypedDict
 import psycopg2
 import datetime
+import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 
@@ -33,3 +37,86 @@ def get_engine():
     engine = create_engine(db_uri)
 
     return engine
+
+
+class CopyStats(TypedDict):
+    nb_rows: int
+    exec_time: float
+    rows_per_second: float
+
+
+def create_staging_table(
+    cursor,
+    table_name: str,
+    like_table: str,
+    unlogged: bool = True,
+    storage_parameters: Optional[List[str]] = None,
+) -> None:
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    with_clause = (
+        f" WITH ({', '.join(storage_parameters)})" if storage_parameters else ""
+    )
+    cursor.execute(
+        f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {table_name} (LIKE {like_table}){with_clause}"
+    )
+
+
+def copy_df_to_table(
+    connection,
+    df: pd.DataFrame,
+    table_name: str,
+    chunk_size: Optional[int] = 100_000,
+    log: Optional[bool] = False,
+) -> CopyStats:
+    # stream the DataFrame through COPY FROM STDIN, one in-memory CSV buffer per chunk.
+    # connection is a DBAPI connection: psycopg2 directly or SQLAlchemy's connection.connection
+    start = time.perf_counter()
+    columns = ", ".join(df.columns)
+    cursor = connection.cursor()
+    for chunk_start in range(0, len(df.index), chunk_size):
+        buffer = io.StringIO()
+        df.iloc[chunk_start : chunk_start + chunk_size].to_csv(
+            buffer, index=False, header=False
+        )
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    exec_time = time.perf_counter() - start
+
+    stats = {
+        "nb_rows": len(df.index),
+        "exec_time": exec_time,
+        "rows_per_second": len(df.index) / exec_time if exec_time > 0 else 0.0,
+    }
+    if log:
+        print_log(
+            f"Copied {stats['nb_rows']} rows to {table_name} in {exec_time:.3f}s ({stats['rows_per_second']:.0f} rows/s)"
+        )
+    return stats
+
+
+def copy_file_to_table(
+    connection, file: str, table_name: str, log: Optional[bool] = False
+) -> CopyStats:
+    # pipe the CSV file handle straight into COPY: no parsing on the Python side and
+    # constant memory whatever the file size. The header line gives the column list
+    start = time.perf_counter()
+    cursor = connection.cursor()
+    with open(file, "r") as f:
+        columns = f.readline().strip()
+        cursor.copy_expert(
+            f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", f
+        )
+    exec_time = time.perf_counter() - start
+
+    stats = {
+        "nb_rows": cursor.rowcount,
+        "exec_time": exec_time,
+        "rows_per_second": cursor.rowcount / exec_time if exec_time > 0 else 0.0,
+    }
+    if log:
+        print_log(
+            f"Copied {stats['nb_rows']} rows from {file} to {table_name} in {exec_time:.3f}s ({stats['rows_per_second']:.0f} rows/s)"
+        )
+    return stats
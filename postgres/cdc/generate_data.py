@@ -1,10 +1,14 @@
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import os
 import random
-from typing import List, Literal, Optional
+import time
+from typing import List, Literal, Optional, Tuple, TypedDict, Union
 from uuid import uuid4
+import numpy as np
 import pandas as pd
 
-from common import connect_db, get_engine, print_log
+from common import connect_db, copy_df_to_table, print_log
 
 
 ORDER_FIELDS = ["market_id", "order_id", "date", "total_price", "nb_items"]
@@ -40,24 +44,37 @@ def create_table(table_name: Optional[str] = "orders"):
 
 
 def load_data():
+    connection = connect_db()
     for market_id in MARKET_IDS:
-        load_df_to_db(generate_order(market_id, "2023-01"))
-        load_df_to_db(generate_order(market_id, "2023-02"))
-        load_df_to_db(generate_order(market_id, "2023-03"))
-        load_df_to_db(generate_order(market_id, "2023-04"))
-        load_df_to_db(generate_order(market_id, "2023-05"))
-        load_df_to_db(generate_order(market_id, "2023-06"))
-        load_df_to_db(generate_order(market_id, "2023-07"))
-        load_df_to_db(generate_order(market_id, "2023-08"))
-        load_df_to_db(generate_order(market_id, "2023-09"))
-        load_df_to_db(generate_order(market_id, "2023-10"))
-        load_df_to_db(generate_order(market_id, "2023-11"))
-        load_df_to_db(generate_order(market_id, "2023-12"))
+        for month in range(1, 13):
+            start_date = datetime(2023, month, 1)
+            load_df_to_db(
+                generate_orders([market_id], start_date, end_of_month(start_date)),
+                connection=connection,
+            )
+    connection.close()
+
+
+def load_df_to_db(
+    df: pd.DataFrame, target_table: Optional[str] = "orders", connection=None
+) -> None:
+    own_connection = connection is None
+    if own_connection:
+        connection = connect_db()
+    copy_df_to_table(connection, df, target_table, log=True)
+    connection.commit()
+    if own_connection:
+        connection.close()
 
 
-def load_df_to_db(df: pd.DataFrame, target_table: Optional[str] = "orders") -> None:
-    engine = get_engine()
-    df.to_sql(target_table, con=engine, if_exists="append", index=False, method="multi")
+class CsvJob(TypedDict):
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"]
+    market_id: str
+    year_month: str
+    nb_versions: int
+    new_orders: int
+    changed_orders: int
+    seed: Optional[int]
 
 
 def generate_csv(
@@ -67,51 +84,87 @@ def generate_csv(
     nb_versions: int,
     new_orders: float,
     changed_orders: float,
+    seed: Optional[int] = None,
 ) -> None:
-    df = generate_order(market_id, year_month)
-    df.to_csv(f"data/{scenario}/order_{market_id}_{year_month}.csv", index=False)
-    current_df = df.copy()
-
-    for i in range(1, nb_versions):
-        if i > 1:
-            # we have a bug when use len(current_df.index)
-            # read df from file in each iteration to avoid the bug
-            current_df = pd.read_csv(
-                f"data/{scenario}/order_{market_id}_{year_month}_updated_{i-1}.csv",
-                parse_dates=[2],
-            )
-        for _ in range(changed_orders):
-            changed_rows = random.randrange(len(current_df.index))
-            new_price = random.randint(100, 10000)
-            new_nb_items = random.randint(1, 20)
-            print_log(
-                f"Update rows {changed_rows}. Price: {new_price}, nb_items: {new_nb_items}. Length current_df: {len(current_df.index)}"
-            )
-            current_df.loc[changed_rows, "total_price"] = new_price
-            current_df.loc[changed_rows, "nb_items"] = new_nb_items
+    generate_csv_versions(
+        {
+            "scenario": scenario,
+            "market_id": market_id,
+            "year_month": year_month,
+            "nb_versions": nb_versions,
+            "new_orders": new_orders,
+            "changed_orders": changed_orders,
+            "seed": seed,
+        }
+    )
 
-        list_new_orders = []
-        for _ in range(new_orders):
-            list_new_orders.append(
-                {
-                    "market_id": market_id,
-                    "order_id": uuid4(),
-                    "date": end_of_month(
-                        datetime.strptime(f"{year_month}-01", "%Y-%m-%d")
-                    ),
-                    "total_price": random.randint(100, 10000),
-                    "nb_items": random.randint(1, 20),
-                }
-            )
-        df_new_orders = pd.DataFrame(list_new_orders)
 
-        current_df = pd.concat([current_df, df_new_orders])
+def generate_csv_parallel(
+    jobs: List[CsvJob], max_workers: Optional[int] = None
+) -> None:
+    # one (scenario, market, month) version chain per process
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for path in executor.map(generate_csv_versions, jobs):
+            print_log(f"Generated versions of {path}")
+
+
+def generate_csv_versions(job: CsvJob) -> str:
+    rng = np.random.default_rng(job["seed"])
+    scenario, market_id, year_month = (
+        job["scenario"],
+        job["market_id"],
+        job["year_month"],
+    )
+    start_date = datetime.strptime(f"{year_month}-01", "%Y-%m-%d")
+    end_date = end_of_month(start_date)
+    os.makedirs(f"data/{scenario}", exist_ok=True)
+
+    current_df = generate_orders([market_id], start_date, end_date, seed=rng)
+    current_df.to_csv(
+        f"data/{scenario}/order_{market_id}_{year_month}.csv", index=False
+    )
+
+    for i in range(1, job["nb_versions"]):
+        current_df = apply_version_changes(
+            current_df,
+            rng,
+            market_id,
+            end_date,
+            job["new_orders"],
+            job["changed_orders"],
+        )
         current_df.to_csv(
             f"data/{scenario}/order_{market_id}_{year_month}_updated_{i}.csv",
             index=False,
             date_format="%Y-%m-%d",
         )
 
+    return f"data/{scenario}/order_{market_id}_{year_month}.csv"
+
+
+def apply_version_changes(
+    df: pd.DataFrame,
+    rng: np.random.Generator,
+    market_id: str,
+    date: datetime,
+    new_orders: int,
+    changed_orders: int,
+) -> pd.DataFrame:
+    # change distinct existing orders, then append the new orders at the given date
+    changed_rows = rng.choice(
+        len(df.index), size=min(changed_orders, len(df.index)), replace=False
+    )
+    df = df.copy()
+    df.iloc[changed_rows, df.columns.get_loc("total_price")] = rng.integers(
+        100, 10000, size=len(changed_rows), endpoint=True
+    )
+    df.iloc[changed_rows, df.columns.get_loc("nb_items")] = rng.integers(
+        1, 20, size=len(changed_rows), endpoint=True
+    )
+    df_new_orders = generate_orders([market_id], date, date, new_orders, seed=rng)
+
+    return pd.concat([df, df_new_orders], ignore_index=True)
+
 
 def generate_order(
     market_id: str, year_month: str, nb_orders_per_day: Optional[int] = 3_000
@@ -142,6 +195,89 @@ def generate_order(
     return df
 
 
+def generate_orders(
+    market_ids: List[str],
+    start_date: datetime,
+    end_date: datetime,
+    nb_orders_per_day: Optional[int] = 3_000,
+    seed: Optional[Union[int, np.random.Generator]] = None,
+) -> pd.DataFrame:
+    # columnar equivalent of generate_order: one array per field instead of one dict per row
+    rng = np.random.default_rng(seed)
+    dates = np.arange(
+        np.datetime64(start_date, "D"),
+        np.datetime64(end_date, "D") + np.timedelta64(1, "D"),
+        dtype="datetime64[D]",
+    )
+    nb_orders = len(dates) * len(market_ids) * nb_orders_per_day
+
+    return pd.DataFrame(
+        {
+            "market_id": np.tile(
+                np.repeat(np.array(market_ids, dtype=object), nb_orders_per_day),
+                len(dates),
+            ),
+            "order_id": generate_uuids(nb_orders, rng if seed is not None else None),
+            "date": np.repeat(dates, len(market_ids) * nb_orders_per_day).astype(
+                "datetime64[ns]"
+            ),
+            "total_price": rng.integers(100, 10000, size=nb_orders, endpoint=True),
+            "nb_items": rng.integers(1, 20, size=nb_orders, endpoint=True),
+        }
+    )
+
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype="S1")
+UUID_HEX_POSITIONS = np.array(
+    [i for i in range(36) if i not in (8, 13, 18, 23)], dtype=np.intp
+)
+
+
+def generate_uuids(
+    nb_uuids: int, rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    # random bytes come from os.urandom unless a seeded generator is given
+    if rng is None:
+        buffer = os.urandom(16 * nb_uuids)
+    else:
+        buffer = rng.bytes(16 * nb_uuids)
+    raw = np.frombuffer(buffer, dtype=np.uint8).reshape(nb_uuids, 16).copy()
+    # set version 4 and RFC 4122 variant bits, as uuid4() does
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+    hex_digits = np.empty((nb_uuids, 32), dtype="S1")
+    hex_digits[:, 0::2] = HEX_DIGITS[raw >> 4]
+    hex_digits[:, 1::2] = HEX_DIGITS[raw & 0x0F]
+    chars = np.full((nb_uuids, 36), b"-", dtype="S1")
+    chars[:, UUID_HEX_POSITIONS] = hex_digits
+
+    return chars.view("S36").ravel().astype(str).astype(object)
+
+
+def benchmark_generate_order(
+    market_id: str = MARKET_IDS[0], year_month: str = "2024-01", nb_runs: int = 3
+) -> None:
+    start_date = datetime.strptime(f"{year_month}-01", "%Y-%m-%d")
+    end_date = end_of_month(start_date)
+
+    for name, func in [
+        ("generate_order", lambda: generate_order(market_id, year_month)),
+        (
+            "generate_orders",
+            lambda: generate_orders([market_id], start_date, end_date, seed=0),
+        ),
+    ]:
+        timings = []
+        for _ in range(nb_runs):
+            start = time.perf_counter()
+            df = func()
+            timings.append(time.perf_counter() - start)
+        print_log(
+            f"{name}: {len(df.index)} orders, best of {nb_runs} runs: {min(timings):.3f}s"
+        )
+
+
 def end_of_month(date: datetime) -> datetime:
     if date.month < 12:
         first_day_of_next_month = datetime(date.year, date.month + 1, 1)
@@ -158,29 +294,39 @@ def run():
     # create_table()
     # load_data()
 
-    # low_diff_ratio: (500 + 90) / 93000= 0.006344
-    generate_csv(
-        "low_diff_ratio", "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c", "2024-01", 15, 500, 90
-    )
-
-    # medium_diff_ratio: (10000 + 8600) / 93000 = 0.2
-    generate_csv(
-        "medium_diff_ratio",
-        "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c",
-        "2024-01",
-        15,
-        10000,
-        8600,
-    )
-
-    # high_diff_ratio: (22000 + 47750) / 93000 = 0,75
-    generate_csv(
-        "high_diff_ratio",
-        "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c",
-        "2024-01",
-        15,
-        22000,
-        47750,
+    generate_csv_parallel(
+        [
+            # low_diff_ratio: (500 + 90) / 93000= 0.006344
+            {
+                "scenario": "low_diff_ratio",
+                "market_id": "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c",
+                "year_month": "2024-01",
+                "nb_versions": 15,
+                "new_orders": 500,
+                "changed_orders": 90,
+                "seed": 1,
+            },
+            # medium_diff_ratio: (10000 + 8600) / 93000 = 0.2
+            {
+                "scenario": "medium_diff_ratio",
+                "market_id": "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c",
+                "year_month": "2024-01",
+                "nb_versions": 15,
+                "new_orders": 10000,
+                "changed_orders": 8600,
+                "seed": 2,
+            },
+            # high_diff_ratio: (22000 + 47750) / 93000 = 0,75
+            {
+                "scenario": "high_diff_ratio",
+                "market_id": "84834db8-c1b4-4e09-90cd-8bae1b4a3f0c",
+                "year_month": "2024-01",
+                "nb_versions": 15,
+                "new_orders": 22000,
+                "changed_orders": 47750,
+                "seed": 3,
+            },
+        ]
     )
 
 
@@ -192,73 +338,47 @@ def load_order_data_test_index_correlation(
     end_date: Optional[datetime] = datetime(2024, 3, 31),
 ):
 
-    date = start_date
-
-    data = []
-    while date <= end_date:
-        for market_id in market_ids:
-            for _ in range(1, nb_orders_per_day + 1):
-                data.append(
-                    {
-                        "market_id": market_id,
-                        "order_id": str(uuid4()),
-                        "date": date,
-                        "total_price": random.randint(100, 10000),
-                        "nb_items": random.randint(1, 20),
-                    }
-                )
-
-        date = date + timedelta(days=1)
-
-    df = pd.DataFrame(data)
+    df = generate_orders(market_ids, start_date, end_date, nb_orders_per_day)
     load_df_to_db(df, table_name)
 
 
-def run_2():
-    table_name = "orders_by_date"
+def quarter_ranges(
+    start_date: datetime, nb_quarters: int
+) -> List[Tuple[datetime, datetime]]:
+    quarters = []
+    for i in range(nb_quarters):
+        month = start_date.month - 1 + 3 * i
+        quarter_start = datetime(start_date.year + month // 12, month % 12 + 1, 1)
+        month += 2
+        quarter_end = end_of_month(
+            datetime(start_date.year + month // 12, month % 12 + 1, 1)
+        )
+        quarters.append((quarter_start, quarter_end))
+    return quarters
+
+
+def build_orders_by_date(
+    table_name: Optional[str] = "orders_by_date",
+    nb_markets: Optional[int] = 1000,
+    nb_orders_per_day: Optional[int] = 5,
+    start_date: Optional[datetime] = datetime(2022, 1, 1),
+    nb_quarters: Optional[int] = 12,
+) -> List[str]:
+    # quarters are loaded one after the other for every market, so the table is
+    # physically ordered by date and market_id is spread over all its pages
     create_table(table_name)
-
-    nb_markets = 1000
     market_ids = [str(uuid4()) for _ in range(nb_markets)]
+    for quarter_start, quarter_end in quarter_ranges(start_date, nb_quarters):
+        load_order_data_test_index_correlation(
+            table_name, market_ids, nb_orders_per_day, quarter_start, quarter_end
+        )
+    return market_ids
 
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2022, 1, 1), datetime(2022, 3, 31)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2022, 4, 1), datetime(2022, 6, 30)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2022, 7, 1), datetime(2022, 9, 30)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2022, 10, 1), datetime(2022, 12, 31)
-    )
-
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2023, 1, 1), datetime(2023, 3, 31)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2023, 4, 1), datetime(2023, 6, 30)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2023, 7, 1), datetime(2023, 9, 30)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2023, 10, 1), datetime(2023, 12, 31)
-    )
 
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2024, 1, 1), datetime(2024, 3, 31)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2024, 4, 1), datetime(2024, 6, 30)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2024, 7, 1), datetime(2024, 9, 30)
-    )
-    load_order_data_test_index_correlation(
-        table_name, market_ids, 5, datetime(2024, 10, 1), datetime(2024, 12, 31)
-    )
+def run_2():
+    build_orders_by_date()
 
 
-run_2()
+if __name__ == "__main__":
+    # benchmark_generate_order()
+    run_2()
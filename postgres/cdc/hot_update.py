@@ -0,0 +1,108 @@
+import itertools
+from typing import List, Literal, Optional
+
+from benchmark_update import run_update_benchmark
+from common import get_engine, print_log
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+
+
+# the columns rewritten by the CDC updates, indexing any of them rules out HOT updates
+UPDATED_COLUMNS = {
+    "none": [],
+    "total_price": ["total_price"],
+    "total_price, nb_items": ["total_price", "nb_items"],
+}
+
+
+def run_hot_experiment(
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+    fillfactors: List[int],
+    indexed: Optional[List[str]] = None,
+    nb_versions: int = 15,
+    output: Optional[str] = None,
+) -> pd.DataFrame:
+    engine = get_engine()
+    results = []
+    # one test table per cell: the incremental method leaves temporary tables named
+    # after it in the pooled session
+    for cell_id, (fillfactor, indexed_name) in enumerate(
+        itertools.product(fillfactors, indexed or list(UPDATED_COLUMNS))
+    ):
+        print_log(
+            f"HOT experiment: fillfactor {fillfactor}, indexed updated columns: {indexed_name}"
+        )
+        with engine.connect() as connection:
+            df = run_update_benchmark(
+                connection,
+                scenario,
+                "incremental",
+                nb_versions=nb_versions,
+                test_table=f"orders_test_hot_{cell_id}",
+                fillfactor=fillfactor,
+                autovacuum=False,
+                indexed_columns=UPDATED_COLUMNS[indexed_name],
+            )
+        df = df.rename_axis("nth_update").reset_index()
+        df["fillfactor"] = fillfactor
+        df["indexed"] = indexed_name
+        df["index_growth"] = df["index_size"] / df.at[0, "index_size"]
+        results.append(df)
+    engine.dispose()
+
+    df = pd.concat(results, ignore_index=True)
+    df["hot_ratio"] = df["n_tuples_hot_updated"] / df["n_tuples_updated"]
+    df.to_csv(output or f"result/{scenario}/result_hot_update.csv", index=False)
+    return df
+
+
+def summarize_hot_experiment(df: pd.DataFrame) -> pd.DataFrame:
+    df_updates = df[df["nth_update"] > 0]
+    df_summary = df_updates.groupby(["indexed", "fillfactor"]).agg(
+        n_tuples_updated=("n_tuples_updated", "sum"),
+        n_tuples_hot_updated=("n_tuples_hot_updated", "sum"),
+        index_growth=("index_growth", "last"),
+        exec_time=("exec_time", "mean"),
+        heap_size=("heap_size", "last"),
+    )
+    df_summary["hot_ratio"] = (
+        df_summary["n_tuples_hot_updated"] / df_summary["n_tuples_updated"]
+    )
+    return df_summary.reset_index()
+
+
+def draw_hot_chart(
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+    df: pd.DataFrame,
+):
+    df_summary = summarize_hot_experiment(df)
+    fig, axes = plt.subplots(1, 3, figsize=(18, 6))
+    for ax, (column, ylabel) in zip(
+        axes,
+        [
+            ("hot_ratio", "HOT updates / updates"),
+            ("index_growth", "Index size after the last update / initial"),
+            ("exec_time", "Mean update time (s)"),
+        ],
+    ):
+        sns.lineplot(
+            data=df_summary,
+            x="fillfactor",
+            y=column,
+            hue="indexed",
+            marker="o",
+            ax=ax,
+        )
+        ax.set_ylabel(ylabel)
+        ax.set_xlabel("Fillfactor")
+    axes[0].set_title("Indexed updated columns vs. HOT updates")
+    plt.tight_layout()
+    plt.savefig(f"result/{scenario}/hot_update.png")
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    df_hot = run_hot_experiment("medium_diff_ratio", fillfactors=[100, 90, 80, 70, 50])
+    print(summarize_hot_experiment(df_hot).to_string())
+    draw_hot_chart("medium_diff_ratio", df_hot)
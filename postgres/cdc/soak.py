@@ -0,0 +1,295 @@
+from datetime import datetime, timedelta
+import os
+import random
+import threading
+import time
+from typing import List, Literal, Optional
+
+from benchmark_update import (
+    UPDATE_METHODS,
+    capture_stats,
+    row_hash_expression,
+    set_storage_parameters,
+)
+from common import (
+    connect_db,
+    copy_df_to_table,
+    create_staging_table,
+    get_engine,
+    print_log,
+)
+from generate_data import MARKET_IDS, apply_version_changes, generate_orders
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+
+READ_QUERIES = {
+    "daily_totals": """SELECT date, count(*), sum(total_price) FROM {table_name}
+        WHERE market_id = %s AND date >= %s AND date < %s GROUP BY date""",
+    "orders_page": """SELECT order_id, total_price, nb_items FROM {table_name}
+        WHERE market_id = %s AND date >= %s AND date < %s ORDER BY date LIMIT 100""",
+}
+
+
+class ReaderPool:
+    # dashboard-like readers: each thread runs range queries by market/date over its
+    # own connection and tags every latency with the soak day it started in
+    def __init__(
+        self,
+        table_name: str,
+        market_ids: List[str],
+        first_date: datetime,
+        last_date: datetime,
+        nb_readers: int = 4,
+        window_days: int = 7,
+    ):
+        self.table_name = table_name
+        self.market_ids = market_ids
+        self.first_date = first_date
+        self.last_date = last_date
+        self.window_days = window_days
+        self.day = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._read, args=(seed,), daemon=True)
+            for seed in range(nb_readers)
+        ]
+
+    def _read(self, seed: int):
+        rng = random.Random(seed)
+        connection = connect_db()
+        connection.autocommit = True
+        cursor = connection.cursor()
+        queries = {
+            name: sql.format(table_name=self.table_name)
+            for name, sql in READ_QUERIES.items()
+        }
+        while not self._stop_event.is_set():
+            day = self.day
+            name = rng.choice(list(queries))
+            nb_days = (self.last_date - self.first_date).days
+            window_end = self.first_date + timedelta(
+                days=rng.randint(self.window_days, nb_days + 1)
+            )
+            window_start = window_end - timedelta(days=self.window_days)
+
+            start = time.perf_counter()
+            cursor.execute(
+                queries[name],
+                (rng.choice(self.market_ids), window_start, window_end),
+            )
+            cursor.fetchall()
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.latencies.append((day, name, latency))
+        connection.close()
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def advance(self, day: int, last_date: datetime):
+        self.day = day
+        self.last_date = last_date
+
+    def stop(self) -> pd.DataFrame:
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        return pd.DataFrame(self.latencies, columns=["day", "query", "latency"])
+
+
+def create_soak_table(
+    connection,
+    table_name: str,
+    df_history: pd.DataFrame,
+    with_row_hash: Optional[bool] = False,
+    autovacuum: Optional[bool] = True,
+):
+    connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    connection.execute(
+        text(
+            f"""CREATE TABLE {table_name} (
+                market_id varchar,
+                order_id varchar PRIMARY KEY,
+                date timestamp,
+                total_price int8,
+                nb_items int4
+            );"""
+        )
+    )
+    connection.commit()
+    copy_df_to_table(connection.connection, df_history, table_name, log=True)
+    connection.connection.commit()
+
+    connection.execute(text(f"CREATE INDEX ON {table_name} (market_id, date);"))
+    if with_row_hash:
+        connection.execute(
+            text(
+                f"ALTER TABLE {table_name} ADD COLUMN row_hash text GENERATED ALWAYS AS ({row_hash_expression()}) STORED;"
+            )
+        )
+        connection.execute(text(f"CREATE INDEX ON {table_name} (order_id, row_hash);"))
+    set_storage_parameters(connection, table_name, autovacuum=autovacuum)
+    connection.commit()
+    connection.execute(text(f"ANALYZE {table_name};"))
+    connection.commit()
+
+
+def capture_vacuum_counts(connection, table_name: str) -> dict:
+    return (
+        connection.execute(
+            text(
+                f"""SELECT autovacuum_count, autoanalyze_count, last_autovacuum
+                FROM pg_stat_user_tables WHERE relid = '{table_name}'::regclass"""
+            )
+        )
+        .mappings()
+        .one()
+    )
+
+
+def run_soak(
+    method: Literal["replace", "incremental", "merge", "incremental_hashed"],
+    nb_days: int = 30,
+    market_ids: Optional[List[str]] = None,
+    start_date: str = "2024-01-01",
+    history_days: int = 31,
+    nb_orders_per_day: int = 3_000,
+    changed_orders: int = 3_000,
+    nb_readers: int = 4,
+    window_days: int = 7,
+    autovacuum: Optional[bool] = True,
+    seed: int = 0,
+    output: Optional[str] = None,
+) -> pd.DataFrame:
+    # every day, every market pushes its month-to-date file: the previous version
+    # with some changed orders plus the orders of the new day
+    # the readers pick windows of window_days inside the history loaded at start
+    if history_days < window_days:
+        raise ValueError(
+            f"history_days ({history_days}) must be at least window_days ({window_days})"
+        )
+    market_ids = market_ids or MARKET_IDS
+    rng = np.random.default_rng(seed)
+    first_date = datetime.strptime(start_date, "%Y-%m-%d")
+    table_name = f"orders_soak_{method}"
+    func = UPDATE_METHODS[method]
+
+    df_history = generate_orders(
+        market_ids,
+        first_date - timedelta(days=history_days),
+        first_date - timedelta(days=1),
+        nb_orders_per_day,
+        seed=rng,
+    )
+    month_start = first_date.replace(day=1)
+    versions = {
+        market_id: df_history[
+            (df_history["market_id"] == market_id) & (df_history["date"] >= month_start)
+        ].reset_index(drop=True)
+        for market_id in market_ids
+    }
+
+    engine = get_engine()
+    connection = engine.connect()
+    create_soak_table(
+        connection,
+        table_name,
+        df_history,
+        with_row_hash=method == "incremental_hashed",
+        autovacuum=autovacuum,
+    )
+    readers = ReaderPool(
+        table_name,
+        market_ids,
+        first_date - timedelta(days=history_days),
+        first_date,
+        nb_readers,
+        window_days,
+    )
+    readers.start()
+
+    days = []
+    try:
+        for day in range(nb_days):
+            date = first_date + timedelta(days=day)
+            readers.advance(day, date)
+            if date.day == 1:
+                month_start = date
+                versions = {
+                    market_id: df.iloc[0:0] for market_id, df in versions.items()
+                }
+            print_log(f"Soak day {day + 1}: {date:%Y-%m-%d}")
+
+            update_time = 0
+            for market_id in market_ids:
+                versions[market_id] = apply_version_changes(
+                    versions[market_id],
+                    rng,
+                    market_id,
+                    date,
+                    nb_orders_per_day,
+                    changed_orders,
+                )
+                tmp_table = f"_tmp_{table_name}"
+                dbapi_connection = connection.connection
+                create_staging_table(dbapi_connection.cursor(), tmp_table, table_name)
+                copy_df_to_table(dbapi_connection, versions[market_id], tmp_table)
+                dbapi_connection.commit()
+
+                start = time.perf_counter()
+                func(
+                    connection,
+                    table_name,
+                    tmp_table,
+                    market_id=market_id,
+                    start_date=f"{month_start:%Y-%m-%d}",
+                    end_date=f"{date:%Y-%m-%d}",
+                )
+                update_time += time.perf_counter() - start
+                # the incremental methods leave a compare table behind in the session
+                connection.execute(text(f"DROP TABLE IF EXISTS {tmp_table}_compare"))
+                connection.execute(text(f"DROP TABLE IF EXISTS {tmp_table}"))
+                connection.commit()
+
+            stats = capture_stats(connection, table_name, "after")
+            days.append(
+                {
+                    "day": day,
+                    "date": date,
+                    "update_time": update_time,
+                    "heap_size": stats["heap_size"],
+                    "index_size": stats["index_size"],
+                    "n_live_tuples": stats["n_live_tuples"],
+                    "n_dead_tuples": stats["n_dead_tuples"],
+                    **capture_vacuum_counts(connection, table_name),
+                }
+            )
+    finally:
+        df_latencies = readers.stop()
+        connection.close()
+        engine.dispose()
+
+    df_percentiles = (
+        df_latencies.groupby(["day", "query"])["latency"]
+        .describe(percentiles=[0.5, 0.95, 0.99])
+        .rename(
+            columns={"count": "nb_queries", "50%": "p50", "95%": "p95", "99%": "p99"}
+        )[["nb_queries", "p50", "p95", "p99"]]
+        .reset_index()
+    )
+    df = pd.DataFrame(days).merge(df_percentiles, on="day", how="left")
+    df["method"] = method
+    output = output or f"result/soak/soak_{method}.csv"
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    df.to_csv(output, index=False)
+    return df
+
+
+if __name__ == "__main__":
+    for method in ["replace", "incremental", "merge"]:
+        run_soak(method)
@@ -0,0 +1,68 @@
+import threading
+import time
+from typing import Optional
+
+from common import connect_db
+import pandas as pd
+
+
+SAMPLE_SQL = """
+WITH RECURSIVE tree AS (
+    SELECT '{table_name}'::regclass::oid AS relid
+    UNION ALL
+    SELECT i.inhrelid FROM pg_inherits i JOIN tree ON i.inhparent = tree.relid
+)
+SELECT
+    (SELECT count(*) FROM pg_stat_activity
+        WHERE datname = current_database() AND state = 'active' AND pid <> pg_backend_pid()
+    ) AS "active_backends",
+    (SELECT count(*) FROM pg_stat_activity
+        WHERE datname = current_database() AND wait_event_type = 'Lock'
+    ) AS "lock_waits",
+    (SELECT count(*) FROM pg_locks WHERE NOT granted) AS "locks_not_granted",
+    (SELECT count(*) FROM pg_locks WHERE relation IN (SELECT relid FROM tree)) AS "table_locks",
+    (SELECT COALESCE(SUM(n_live_tup), 0)::int8 FROM pg_stat_user_tables
+        WHERE relid IN (SELECT relid FROM tree)
+    ) AS "n_live_tuples",
+    (SELECT COALESCE(SUM(n_dead_tup), 0)::int8 FROM pg_stat_user_tables
+        WHERE relid IN (SELECT relid FROM tree)
+    ) AS "n_dead_tuples",
+    (SELECT temp_files FROM pg_stat_database WHERE datname = current_database()) AS "temp_files",
+    (SELECT temp_bytes FROM pg_stat_database WHERE datname = current_database()) AS "temp_bytes"
+"""
+
+
+class StatsSampler(threading.Thread):
+    # polls activity, locks and table counters over a second connection while an
+    # update runs. Table counters of the updating backend only show up once it
+    # flushes them, i.e. mostly after its transaction ends
+    def __init__(self, table_name: str, interval: Optional[float] = 0.1):
+        super().__init__(daemon=True)
+        self.table_name = table_name
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        connection = connect_db()
+        connection.autocommit = True
+        cursor = connection.cursor()
+        sql = SAMPLE_SQL.format(table_name=self.table_name)
+        start = time.perf_counter()
+        while True:
+            cursor.execute(sql)
+            row = cursor.fetchone()
+            self.samples.append(
+                {
+                    "elapsed": time.perf_counter() - start,
+                    **dict(zip([column.name for column in cursor.description], row)),
+                }
+            )
+            if self._stop_event.wait(self.interval):
+                break
+        connection.close()
+
+    def stop(self) -> pd.DataFrame:
+        self._stop_event.set()
+        self.join()
+        return pd.DataFrame(self.samples)
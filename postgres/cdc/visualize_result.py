@@ -1,3 +1,4 @@
+import os
 from typing import Literal
 import seaborn as sns
 import pandas as pd
@@ -5,6 +6,16 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 
 
+METHODS = [
+    "replace",
+    "incremental",
+    "client_diff",
+    "merge",
+    "incremental_hashed",
+    "partition_swap",
+]
+
+
 # Function to format y-axis ticks without scientific notation
 def format_y_ticks(value, pos):
     return "{:.2f}".format(value)
@@ -13,35 +24,21 @@ def format_y_ticks(value, pos):
 def draw_chart(
     scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
 ):
-    df_replace = pd.read_csv(f"result/{scenario}/result_update_data_replace.csv")
-    df_incremental = pd.read_csv(
-        f"result/{scenario}/result_update_data_incremental.csv"
-    )
-
-    df_replace["index_size_changed"] = (
-        df_replace["index_size"] - df_replace.at[0, "index_size"]
-    )
-    df_replace["heap_size_changed"] = (
-        df_replace["heap_size"] - df_replace.at[0, "heap_size"]
-    )
-    df_incremental["index_size_changed"] = (
-        df_incremental["index_size"] - df_incremental.at[0, "index_size"]
-    )
-    df_incremental["heap_size_changed"] = (
-        df_incremental["heap_size"] - df_incremental.at[0, "heap_size"]
-    )
-    df_replace["index_size_changed"] = df_replace["index_size_changed"] / (1024 * 1024)
-    df_replace["heap_size_changed"] = df_replace["heap_size_changed"] / (1024 * 1024)
-    df_incremental["index_size_changed"] = df_incremental["index_size_changed"] / (
-        1024 * 1024
-    )
-    df_incremental["heap_size_changed"] = df_incremental["heap_size_changed"] / (
-        1024 * 1024
-    )
-
-    df_replace["group"] = "replace update"
-    df_incremental["group"] = "incremental update"
-    combined_df = pd.concat([df_replace, df_incremental])
+    dfs = []
+    for method in METHODS:
+        file = f"result/{scenario}/result_update_data_{method}.csv"
+        if not os.path.exists(file):
+            continue
+        df = pd.read_csv(file)
+        df["index_size_changed"] = (df["index_size"] - df.at[0, "index_size"]) / (
+            1024 * 1024
+        )
+        df["heap_size_changed"] = (df["heap_size"] - df.at[0, "heap_size"]) / (
+            1024 * 1024
+        )
+        df["group"] = f"{' '.join(method.split('_'))} update"
+        dfs.append(df)
+    combined_df = pd.concat(dfs)
 
     combined_df.rename(columns={"Unnamed: 0": "nth_update"}, inplace=True)
     print(combined_df)
@@ -105,7 +102,241 @@ def draw_chart(
     plt.savefig(f"result/{scenario}/dead_tuples.png")
     plt.clf()
 
+    if "wal_lsn_bytes" in combined_df.columns:
+        combined_df["wal_lsn_mb"] = combined_df["wal_lsn_bytes"] / (1024 * 1024)
+    if "n_tuples_updated" in combined_df.columns:
+        combined_df["hot_ratio"] = (
+            combined_df["n_tuples_hot_updated"] / combined_df["n_tuples_updated"]
+        )
+    for column, ylabel, title, file_name in [
+        ("wal_lsn_mb", "WAL generated (MB)", "WAL generated", "wal_generated"),
+        ("wal_fpi", "Number of full page images", "WAL full page images", "wal_fpi"),
+        (
+            "checkpoints",
+            "Number of checkpoints",
+            "Checkpoints triggered",
+            "checkpoints",
+        ),
+        ("io_writes", "Number of writes", "Backend writes", "io_writes"),
+        ("io_fsyncs", "Number of fsyncs", "Backend fsyncs", "io_fsyncs"),
+        (
+            "n_tuples_hot_updated",
+            "Number of HOT updates",
+            "HOT updates",
+            "hot_updates",
+        ),
+        ("hot_ratio", "HOT updates / updates", "HOT update ratio", "hot_ratio"),
+    ]:
+        if column not in combined_df.columns:
+            continue
+        chart = sns.lineplot(
+            data=combined_df.dropna(subset=[column]),
+            x="nth_update",
+            y=column,
+            hue="group",
+            marker="o",
+        )
+        plt.xlabel("nth update")
+        plt.ylabel(ylabel)
+        plt.gca().get_yaxis().set_major_formatter(FuncFormatter(format_y_ticks))
+        plt.title(title)
+        sns.move_legend(chart, "upper center")
+        plt.savefig(f"result/{scenario}/{file_name}.png")
+        plt.clf()
+
+
+def draw_step_breakdown(
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+):
+    dfs = {}
+    for method in METHODS:
+        file = f"result/{scenario}/result_update_data_{method}.csv"
+        if not os.path.exists(file):
+            continue
+        df = pd.read_csv(file).rename(columns={"Unnamed: 0": "nth_update"})
+        step_columns = [
+            column
+            for column in df.columns
+            if column.startswith("step_") and column.endswith("_time")
+        ]
+        if step_columns:
+            dfs[method] = (
+                df.dropna(subset=["exec_time"])
+                .set_index("nth_update")[step_columns]
+                .rename(columns=lambda column: column[len("step_") : -len("_time")])
+            )
+    if not dfs:
+        return
+
+    fig, axes = plt.subplots(
+        len(dfs), 1, figsize=(12, 4 * len(dfs)), sharex=True, squeeze=False
+    )
+    for ax, (method, df) in zip(axes[:, 0], dfs.items()):
+        df.plot(kind="bar", stacked=True, ax=ax)
+        ax.set_title(f"{' '.join(method.split('_'))} update")
+        ax.set_ylabel("Execution Time (s)")
+        ax.legend(loc="upper left", bbox_to_anchor=(1, 1))
+    axes[-1, 0].set_xlabel("nth update")
+    plt.tight_layout()
+    plt.savefig(f"result/{scenario}/step_breakdown.png")
+    plt.close(fig)
+
+
+def draw_step_io_breakdown(
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+):
+    # buffers touched and WAL written by each step, from the runs with explain
+    counters = [
+        (
+            [
+                "shared_blks_hit",
+                "shared_blks_read",
+                "local_blks_hit",
+                "local_blks_read",
+            ],
+            "Buffers (hit + read)",
+            1,
+        ),
+        (["wal_bytes"], "WAL generated (MB)", 1024 * 1024),
+    ]
+    dfs = {}
+    for method in METHODS:
+        file = f"result/{scenario}/result_update_data_{method}.csv"
+        if not os.path.exists(file):
+            continue
+        df = pd.read_csv(file).rename(columns={"Unnamed: 0": "nth_update"})
+        df = df.dropna(subset=["exec_time"]).set_index("nth_update")
+        steps = [
+            column[len("step_") : -len("_time")]
+            for column in df.columns
+            if column.startswith("step_") and column.endswith("_time")
+        ]
+        breakdowns = []
+        for keys, _, unit in counters:
+            breakdown = pd.DataFrame(
+                {
+                    step: df[
+                        [
+                            f"step_{step}_{key}"
+                            for key in keys
+                            if f"step_{step}_{key}" in df.columns
+                        ]
+                    ].sum(axis=1, min_count=1)
+                    / unit
+                    for step in steps
+                }
+            ).dropna(axis=1, how="all")
+            breakdowns.append(breakdown)
+        if not breakdowns[0].empty:
+            dfs[method] = breakdowns
+    if not dfs:
+        return
+
+    fig, axes = plt.subplots(
+        len(dfs), len(counters), figsize=(16, 4 * len(dfs)), sharex=True, squeeze=False
+    )
+    for row, (method, breakdowns) in zip(axes, dfs.items()):
+        for ax, breakdown, (_, ylabel, _) in zip(row, breakdowns, counters):
+            breakdown.plot(kind="bar", stacked=True, ax=ax, legend=False)
+            ax.set_title(f"{' '.join(method.split('_'))} update")
+            ax.set_ylabel(ylabel)
+        row[-1].legend(loc="upper left", bbox_to_anchor=(1, 1))
+    for ax in axes[-1]:
+        ax.set_xlabel("nth update")
+    plt.tight_layout()
+    plt.savefig(f"result/{scenario}/step_io_breakdown.png")
+    plt.close(fig)
+
+
+def draw_timelines(
+    scenario: Literal["low_diff_ratio", "medium_diff_ratio", "high_diff_ratio"],
+):
+    for method in METHODS:
+        file = f"result/{scenario}/samples_{method}.parquet"
+        if not os.path.exists(file):
+            continue
+        df = pd.read_parquet(file)
+        # temp bytes written since the update started, each update from its own baseline
+        df["temp_mb"] = (
+            df["temp_bytes"] - df.groupby("nth_update")["temp_bytes"].transform("first")
+        ) / (1024 * 1024)
+
+        fig, axes = plt.subplots(4, 1, figsize=(12, 14), sharex=True)
+        for ax, (column, ylabel) in zip(
+            axes,
+            [
+                ("n_dead_tuples", "Number of dead tuples"),
+                ("lock_waits", "Backends waiting on a lock"),
+                ("table_locks", "Locks on the table"),
+                ("temp_mb", "Temp files written (MB)"),
+            ],
+        ):
+            sns.lineplot(
+                data=df,
+                x="elapsed",
+                y=column,
+                hue="nth_update",
+                palette="viridis",
+                ax=ax,
+            )
+            ax.set_ylabel(ylabel)
+        axes[0].set_title(f"Timeline during each {' '.join(method.split('_'))} update")
+        axes[-1].set_xlabel("Time since the update started (s)")
+        plt.tight_layout()
+        plt.savefig(f"result/{scenario}/timeline_{method}.png")
+        plt.close(fig)
+
+
+def draw_soak():
+    files = [f"result/soak/soak_{method}.csv" for method in METHODS]
+    files = [file for file in files if os.path.exists(file)]
+    if not files:
+        return
+    df = pd.concat([pd.read_csv(file) for file in files], ignore_index=True)
+    df_latency = df.melt(
+        id_vars=["day", "method", "query"],
+        value_vars=["p50", "p95", "p99"],
+        var_name="percentile",
+        value_name="latency",
+    )
+    df_latency["latency"] = df_latency["latency"] * 1000
+
+    g = sns.relplot(
+        data=df_latency,
+        x="day",
+        y="latency",
+        hue="method",
+        style="percentile",
+        col="query",
+        kind="line",
+    )
+    g.set_axis_labels("Day", "Read latency (ms)")
+    g.savefig("result/soak/read_latency.png")
+
+    df_days = df.drop_duplicates(["method", "day"])
+    fig, axes = plt.subplots(2, 1, figsize=(12, 10), sharex=True)
+    sns.lineplot(data=df_days, x="day", y="n_dead_tuples", hue="method", ax=axes[0])
+    axes[0].set_ylabel("Number of dead tuples")
+    axes[0].yaxis.set_major_formatter(FuncFormatter(format_y_ticks))
+    sns.lineplot(data=df_days, x="day", y="heap_size", hue="method", ax=axes[1])
+    axes[1].set_ylabel("Heap size")
+    axes[1].yaxis.set_major_formatter(FuncFormatter(format_y_ticks))
+    axes[1].set_xlabel("Day")
+    plt.tight_layout()
+    plt.savefig("result/soak/bloat.png")
+    plt.close(fig)
+
 
 draw_chart("low_diff_ratio")
 draw_chart("medium_diff_ratio")
 draw_chart("high_diff_ratio")
+draw_step_breakdown("low_diff_ratio")
+draw_step_breakdown("medium_diff_ratio")
+draw_step_breakdown("high_diff_ratio")
+draw_step_io_breakdown("low_diff_ratio")
+draw_step_io_breakdown("medium_diff_ratio")
+draw_step_io_breakdown("high_diff_ratio")
+draw_timelines("low_diff_ratio")
+draw_timelines("medium_diff_ratio")
+draw_timelines("high_diff_ratio")
+draw_soak()
@@ -0,0 +1,192 @@
+import time
+from typing import List, Literal, Optional, Tuple
+import numpy as np
+import pandas as pd
+from numba import njit
+
+from common import print_log
+from cost_model import pages_fetched_correlated
+
+
+# BM_MAX_USAGE_COUNT in buf_internals.h
+MAX_USAGE_COUNT = 5
+
+
+def generate_trace(
+    T: int,
+    N: int,
+    s: float,
+    correlation: float,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    # heap pages read by an index scan over a range of s * N keys, in index order.
+    # A fraction |correlation| of the tuples sits at the page of its key rank, the others
+    # on a random page: the Pearson correlation between key rank and page is ~correlation
+    rng = np.random.default_rng(seed)
+    nb_tuples = int(round(s * N))
+    start = rng.integers(0, N - nb_tuples + 1)
+    ranks = np.arange(start, start + nb_tuples, dtype=np.int64)
+    if correlation < 0:
+        ranks = N - 1 - ranks
+    pages = ranks * T // N
+    moved = rng.random(nb_tuples) >= abs(correlation)
+    pages[moved] = rng.integers(0, T, size=moved.sum())
+    return pages
+
+
+def collapse_repeats(
+    trace: np.ndarray, checkpoints: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # consecutive tuples on the same page are read from the pinned buffer, they are
+    # hits for any replacement policy and can be dropped before replaying the trace.
+    # checkpoints (a number of accesses) are mapped to the collapsed trace
+    keep = np.empty(len(trace), dtype=np.bool_)
+    keep[:1] = True
+    np.not_equal(trace[1:], trace[:-1], out=keep[1:])
+    kept_before = np.concatenate(([0], np.cumsum(keep)))
+    return trace[keep], kept_before[checkpoints]
+
+
+@njit(cache=True)
+def simulate_lru(trace, T, b, checkpoints):
+    # doubly linked list over page ids, T is the head sentinel: head.next is the most
+    # recently used page and head.prev the next victim
+    prev = np.full(T + 1, T, dtype=np.int64)
+    next_ = np.full(T + 1, T, dtype=np.int64)
+    cached = np.zeros(T, dtype=np.bool_)
+    misses = np.zeros(len(checkpoints), dtype=np.int64)
+    nb_cached = 0
+    nb_misses = 0
+    checkpoint = 0
+    for i in range(len(trace)):
+        while checkpoint < len(checkpoints) and checkpoints[checkpoint] == i:
+            misses[checkpoint] = nb_misses
+            checkpoint += 1
+        page = trace[i]
+        if cached[page]:
+            next_[prev[page]] = next_[page]
+            prev[next_[page]] = prev[page]
+        else:
+            nb_misses += 1
+            if nb_cached == b:
+                victim = prev[T]
+                next_[prev[victim]] = T
+                prev[T] = prev[victim]
+                cached[victim] = False
+            else:
+                nb_cached += 1
+            cached[page] = True
+        next_[page] = next_[T]
+        prev[page] = T
+        prev[next_[T]] = page
+        next_[T] = page
+    while checkpoint < len(checkpoints):
+        misses[checkpoint] = nb_misses
+        checkpoint += 1
+    return misses
+
+
+@njit(cache=True)
+def simulate_clock_sweep(trace, T, b, checkpoints):
+    # StrategyGetBuffer without ring buffers: free buffers first, then the clock hand
+    # decrements usage counts until it finds a buffer at 0
+    buffer_page = np.full(b, -1, dtype=np.int64)
+    usage_count = np.zeros(b, dtype=np.int8)
+    page_buffer = np.full(T, -1, dtype=np.int64)
+    misses = np.zeros(len(checkpoints), dtype=np.int64)
+    nb_used = 0
+    hand = 0
+    nb_misses = 0
+    checkpoint = 0
+    for i in range(len(trace)):
+        while checkpoint < len(checkpoints) and checkpoints[checkpoint] == i:
+            misses[checkpoint] = nb_misses
+            checkpoint += 1
+        page = trace[i]
+        buffer = page_buffer[page]
+        if buffer >= 0:
+            if usage_count[buffer] < MAX_USAGE_COUNT:
+                usage_count[buffer] += 1
+            continue
+        nb_misses += 1
+        if nb_used < b:
+            buffer = nb_used
+            nb_used += 1
+        else:
+            while usage_count[hand] > 0:
+                usage_count[hand] -= 1
+                hand = (hand + 1) % b
+            buffer = hand
+            hand = (hand + 1) % b
+            page_buffer[buffer_page[buffer]] = -1
+        buffer_page[buffer] = page
+        page_buffer[page] = buffer
+        usage_count[buffer] = 1
+    while checkpoint < len(checkpoints):
+        misses[checkpoint] = nb_misses
+        checkpoint += 1
+    return misses
+
+
+SIMULATORS = {"lru": simulate_lru, "clock_sweep": simulate_clock_sweep}
+
+
+def simulate_pages_fetched(
+    T: int,
+    N: int,
+    b: int,
+    selectivities,
+    correlation: float = 0,
+    policy: Literal["lru", "clock_sweep"] = "lru",
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    # the ranges of smaller selectivities are prefixes of the largest one, so a single
+    # trace is replayed from a cold cache and the misses are read at each prefix length
+    selectivities = np.sort(np.asarray(selectivities, dtype=float))
+    trace = generate_trace(T, N, selectivities[-1], correlation, seed)
+    checkpoints = np.minimum(np.round(selectivities * N).astype(np.int64), len(trace))
+    trace, checkpoints = collapse_repeats(trace, checkpoints)
+    return SIMULATORS[policy](trace, T, min(b, T), checkpoints)
+
+
+def compare_with_formula(
+    T: int,
+    N: int,
+    b: int,
+    selectivities,
+    correlations: Optional[List[float]] = None,
+    policies: Optional[List[str]] = None,
+    seed: Optional[int] = 0,
+) -> pd.DataFrame:
+    correlations = [0, 1] if correlations is None else correlations
+    policies = list(SIMULATORS) if policies is None else policies
+    selectivities = np.sort(np.asarray(selectivities, dtype=float))
+    rows = []
+    for correlation in correlations:
+        for policy in policies:
+            start = time.perf_counter()
+            pages = simulate_pages_fetched(
+                T, N, b, selectivities, correlation, policy, seed
+            )
+            print_log(
+                f"{policy}, correlation={correlation:g}: {selectivities[-1] * N:.0f} accesses replayed in {time.perf_counter() - start:.2f}s"
+            )
+            rows.append(
+                pd.DataFrame(
+                    {
+                        "selectivity": selectivities,
+                        "correlation": correlation,
+                        "policy": policy,
+                        "simulated_pages": pages,
+                    }
+                )
+            )
+    df = pd.concat(rows, ignore_index=True)
+    s = df["selectivity"].to_numpy()
+    df["formula_pages"] = pages_fetched_correlated(
+        s, T, N, b, df["correlation"].to_numpy()
+    )
+    df["relative_error"] = (df["formula_pages"] - df["simulated_pages"]) / df[
+        "simulated_pages"
+    ].where(df["simulated_pages"] > 0)
+    return df
@@ -0,0 +1,275 @@
+import itertools
+import json
+from typing import List, Literal, Optional, TypedDict
+import numpy as np
+import pandas as pd
+from matplotlib import pylab as plt
+
+from common import connect_db, print_log
+from cost_model import (
+    CPU_INDEX_TUPLE_COST,
+    CPU_TUPLE_COST,
+    DEFAULT_COST_PARAMETERS,
+    SEQ_PAGE_COST,
+    CostParameters,
+    index_scan_cost,
+    seq_scan_cost,
+)
+
+
+# planner settings that leave a single, non parallel, access path for the range query
+SCAN_SETTINGS = {
+    "seq": {
+        "enable_indexscan": "off",
+        "enable_bitmapscan": "off",
+        "max_parallel_workers_per_gather": "0",
+    },
+    "index": {
+        "enable_seqscan": "off",
+        "enable_bitmapscan": "off",
+        "max_parallel_workers_per_gather": "0",
+    },
+}
+# always true predicates, they add operator evaluations without changing the selectivity
+EXTRA_PREDICATES = ["total_price >= 0", "nb_items >= 0"]
+
+
+class TableStats(TypedDict):
+    T: int
+    N: float
+    t: int
+    n: float
+    min_date: str
+    max_date: str
+
+
+def prepare_table(cursor, table_name: str) -> TableStats:
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {table_name}_date_idx ON {table_name} (date);"
+    )
+    cursor.execute(f"ANALYZE {table_name};")
+    cursor.execute(
+        f"""SELECT c.relpages, c.reltuples, i.relpages, i.reltuples
+        FROM pg_class c, pg_class i
+        WHERE c.oid = '{table_name}'::regclass AND i.oid = '{table_name}_date_idx'::regclass"""
+    )
+    T, N, t, n = cursor.fetchone()
+    cursor.execute(f"SELECT min(date), max(date) FROM {table_name};")
+    min_date, max_date = cursor.fetchone()
+    return {"T": T, "N": N, "t": t, "n": n, "min_date": min_date, "max_date": max_date}
+
+
+def run_range_query(
+    cursor,
+    table_name: str,
+    start,
+    end,
+    scan: Literal["seq", "index"],
+    nb_extra_predicates: int = 0,
+) -> dict:
+    for setting, value in SCAN_SETTINGS[scan].items():
+        cursor.execute(f"SET {setting} = {value};")
+    # the always true predicates come first: AND stops at the first false predicate,
+    # and quals of equal cost keep their order, so a seq scan evaluates all k1
+    # predicates on every row it scans
+    predicates = EXTRA_PREDICATES[:nb_extra_predicates] + ["date >= %s", "date < %s"]
+    k1 = len(predicates)
+    cursor.execute(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT * FROM {table_name} WHERE {' AND '.join(predicates)}",
+        (start, end),
+    )
+    result = cursor.fetchone()[0]
+    result = json.loads(result) if isinstance(result, str) else result
+    cursor.execute("RESET ALL;")
+
+    plan = result[0]["Plan"]
+    return {
+        "scan": scan,
+        "k1": k1,
+        "node_type": plan["Node Type"],
+        "rows": plan["Actual Rows"],
+        "rows_removed_by_filter": plan.get("Rows Removed by Filter", 0),
+        "shared_hit_blocks": plan["Shared Hit Blocks"],
+        "shared_read_blocks": plan["Shared Read Blocks"],
+        "planner_cost": plan["Total Cost"],
+        "execution_time": result[0]["Execution Time"],
+    }
+
+
+def run_calibration_queries(
+    table_name: str = "orders_by_date",
+    selectivities: Optional[List[float]] = None,
+    nb_runs: int = 3,
+) -> pd.DataFrame:
+    # each query runs once to warm the cache, then nb_runs times: the median run is kept
+    selectivities = (
+        np.geomspace(0.0005, 0.5, 12) if selectivities is None else selectivities
+    )
+    connection = connect_db()
+    connection.autocommit = True
+    cursor = connection.cursor()
+    table_stats = prepare_table(cursor, table_name)
+    print_log(f"Calibrating on {table_name}: {table_stats}")
+
+    runs = []
+    for s in selectivities:
+        start = table_stats["min_date"]
+        end = start + (table_stats["max_date"] - start) * float(s)
+        for scan, nb_extra_predicates in itertools.product(
+            SCAN_SETTINGS, range(len(EXTRA_PREDICATES) + 1)
+        ):
+            query = (cursor, table_name, start, end, scan, nb_extra_predicates)
+            run_range_query(*query)
+            results = [run_range_query(*query) for _ in range(nb_runs)]
+            run = sorted(results, key=lambda result: result["execution_time"])[
+                nb_runs // 2
+            ]
+            runs.append({"selectivity": run["rows"] / table_stats["N"], **run})
+            print_log(
+                f"s={runs[-1]['selectivity']:.4f} {scan} scan, {run['k1']} operators: {run['execution_time']:.1f} ms"
+            )
+    connection.close()
+
+    df = pd.DataFrame(runs)
+    df.attrs["table_stats"] = table_stats
+    return df
+
+
+def model_cost(
+    df: pd.DataFrame, table_stats: TableStats, params: CostParameters
+) -> np.ndarray:
+    # the draw_graph model with correlation 1, as orders_by_date is loaded by date
+    T, N, t, n = table_stats["T"], table_stats["N"], table_stats["t"], table_stats["n"]
+    s = df["selectivity"].to_numpy()
+    k1 = df["k1"].to_numpy()
+    best_case, _ = index_scan_cost(s, T, N, T, t, n, k1, 2, params)
+    return np.where(df["scan"] == "seq", seq_scan_cost(T, N, k1, params), best_case)
+
+
+def nonnegative_least_squares(X: np.ndarray, y: np.ndarray) -> np.ndarray:
+    # exact NNLS for a few columns: the solution is the unconstrained least squares
+    # on some subset of the columns, the others at 0
+    best_coefficients, best_residual = np.zeros(X.shape[1]), np.sum(np.square(y))
+    for nb_columns in range(1, X.shape[1] + 1):
+        for columns in itertools.combinations(range(X.shape[1]), nb_columns):
+            solution, *_ = np.linalg.lstsq(X[:, columns], y, rcond=None)
+            if np.any(solution < 0):
+                continue
+            coefficients = np.zeros(X.shape[1])
+            coefficients[list(columns)] = solution
+            residual = np.sum(np.square(y - X @ coefficients))
+            if residual < best_residual:
+                best_coefficients, best_residual = coefficients, residual
+    return best_coefficients
+
+
+def fit_cost_parameters(df: pd.DataFrame, table_stats: TableStats) -> CostParameters:
+    # On one table every seq scan reads the same pages and tuples, and index scans read
+    # pages in proportion to rows, so pages and per-tuple cpu costs can't be told apart.
+    # cpu_tuple_cost and cpu_index_tuple_cost keep their default ratio to seq_page_cost,
+    # and the fit gives the ms of a seq page, a random page and an operator. The
+    # features are the terms of model_cost, so the fit and the prediction agree
+    unit = dict.fromkeys(DEFAULT_COST_PARAMETERS, 0.0)
+    X = np.column_stack(
+        [
+            model_cost(
+                df,
+                table_stats,
+                {
+                    **unit,
+                    "seq_page_cost": 1.0,
+                    "cpu_tuple_cost": CPU_TUPLE_COST / SEQ_PAGE_COST,
+                    "cpu_index_tuple_cost": CPU_INDEX_TUPLE_COST / SEQ_PAGE_COST,
+                },
+            ),
+            model_cost(df, table_stats, {**unit, "random_page_cost": 1.0}),
+            model_cost(df, table_stats, {**unit, "cpu_operator_cost": 1.0}),
+        ]
+    )
+    ms_per_seq_page, ms_per_random_page, ms_per_operator = nonnegative_least_squares(
+        X, df["execution_time"].to_numpy(dtype=float)
+    )
+    if ms_per_seq_page <= 0:
+        raise ValueError(
+            "The fitted time of a sequential page is 0, the measures can't calibrate the cost units"
+        )
+    if ms_per_random_page <= 0 or ms_per_operator <= 0:
+        print_log(
+            "The fit is bounded at 0 for random pages or operators, their cost is too small to be measured on this table"
+        )
+    return {
+        "seq_page_cost": SEQ_PAGE_COST,
+        "random_page_cost": SEQ_PAGE_COST * ms_per_random_page / ms_per_seq_page,
+        "cpu_tuple_cost": CPU_TUPLE_COST,
+        "cpu_index_tuple_cost": CPU_INDEX_TUPLE_COST,
+        "cpu_operator_cost": SEQ_PAGE_COST * ms_per_operator / ms_per_seq_page,
+        "ms_per_cost_unit": ms_per_seq_page / SEQ_PAGE_COST,
+    }
+
+
+def predict_times(
+    df: pd.DataFrame, table_stats: TableStats, params: CostParameters
+) -> np.ndarray:
+    return model_cost(df, table_stats, params) * params["ms_per_cost_unit"]
+
+
+def calibrate(
+    table_name: str = "orders_by_date",
+    selectivities: Optional[List[float]] = None,
+    nb_runs: int = 3,
+):
+    df = run_calibration_queries(table_name, selectivities, nb_runs)
+    table_stats = df.attrs["table_stats"]
+    params = fit_cost_parameters(df, table_stats)
+    # default GUCs, converted to ms with the fitted time of a sequential page
+    default_params = {
+        **DEFAULT_COST_PARAMETERS,
+        "ms_per_cost_unit": params["ms_per_cost_unit"],
+    }
+    df["predicted_time"] = predict_times(df, table_stats, params)
+    df["predicted_time_default"] = predict_times(df, table_stats, default_params)
+
+    print_log("Recommended settings:")
+    for setting in DEFAULT_COST_PARAMETERS:
+        print(
+            f"{setting} = {params[setting]:.4f}  # default {DEFAULT_COST_PARAMETERS[setting]}"
+        )
+    return df, params
+
+
+def draw_calibration_chart(df: pd.DataFrame, scenario: str):
+    plt.figure(figsize=(12, 6))
+    for scan, color in [("seq", "blue"), ("index", "orange")]:
+        df_scan = df[(df["scan"] == scan) & (df["k1"] == 2)]
+        plt.plot(
+            df_scan["selectivity"],
+            df_scan["execution_time"],
+            "o",
+            color=color,
+            label=f"{scan}_scan_measured",
+        )
+        plt.plot(
+            df_scan["selectivity"],
+            df_scan["predicted_time"],
+            color=color,
+            label=f"{scan}_scan_fitted",
+        )
+        plt.plot(
+            df_scan["selectivity"],
+            df_scan["predicted_time_default"],
+            "--",
+            color=color,
+            label=f"{scan}_scan_default_gucs",
+        )
+    plt.xscale("log")
+    plt.xlabel("Selectivity")
+    plt.ylabel("Execution time (ms)")
+    plt.title("Measured vs. predicted execution time")
+    plt.legend()
+    plt.savefig(f"./calibration_{scenario}.png")
+
+
+if __name__ == "__main__":
+    df_calibration, _ = calibrate()
+    df_calibration.to_csv("./calibration_orders_by_date.csv", index=False)
+    draw_calibration_chart(df_calibration, "orders_by_date")
@@ -0,0 +1,144 @@
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from common import connect_db, print_log
+from cost_model import (
+    DEFAULT_COST_PARAMETERS,
+    CostParameters,
+    cluster_speedup,
+    index_scan_cost,
+    index_scan_cost_correlated,
+    seq_scan_cost,
+)
+from crossover import crossover_table
+
+
+SETTINGS_SQL = """
+SELECT name, setting::float8 FROM pg_settings
+WHERE name IN (
+    'block_size', 'shared_buffers', 'effective_cache_size',
+    'seq_page_cost', 'random_page_cost', 'cpu_tuple_cost',
+    'cpu_index_tuple_cost', 'cpu_operator_cost'
+)
+"""
+# one row per (table, index) pair with the leading column of the index, its correlation
+# comes from pg_stats. reltuples is -1 for a table that was never analyzed
+INDEXES_SQL = """
+SELECT
+    n.nspname AS schema_name,
+    c.relname AS table_name,
+    ic.relname AS index_name,
+    a.attname AS column_name,
+    c.relpages AS "T",
+    NULLIF(c.reltuples, -1) AS "N",
+    ic.relpages AS "t",
+    NULLIF(ic.reltuples, -1) AS "n",
+    s.correlation
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_class ic ON ic.oid = i.indexrelid
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+LEFT JOIN pg_stats s
+    ON s.schemaname = n.nspname AND s.tablename = c.relname
+    AND s.attname = a.attname AND NOT s.inherited
+WHERE n.nspname = ANY(%(schemas)s) AND c.relkind IN ('r', 'm')
+ORDER BY schema_name, table_name, index_name
+"""
+
+
+def collect_catalog(
+    cursor, schemas: Optional[List[str]] = None
+) -> Tuple[pd.DataFrame, dict]:
+    # two catalog queries whatever the number of tables
+    cursor.execute(SETTINGS_SQL)
+    settings = dict(cursor.fetchall())
+    cursor.execute(INDEXES_SQL, {"schemas": schemas or ["public"]})
+    df = pd.DataFrame(
+        cursor.fetchall(), columns=[column.name for column in cursor.description]
+    )
+    return df, settings
+
+
+def cost_parameters_from_settings(settings: dict) -> CostParameters:
+    return {name: settings[name] for name in DEFAULT_COST_PARAMETERS}
+
+
+def evaluate_catalog(
+    df_indexes: pd.DataFrame,
+    b: float,
+    params: CostParameters = DEFAULT_COST_PARAMETERS,
+    selectivities: Optional[List[float]] = None,
+    k1: int = 1,
+    k2: int = 1,
+) -> pd.DataFrame:
+    # every (table, index) pair x selectivity is evaluated in one broadcast call
+    selectivities = np.asarray(
+        [0.001, 0.01, 0.1] if selectivities is None else selectivities
+    )
+    # tables never analyzed or empty have no usable statistics
+    df = df_indexes.dropna(subset=["N", "n"])
+    df = df[(df[["T", "N", "t", "n"]] > 0).all(axis=1)].reset_index(drop=True)
+    df["k1"] = k1
+    df["k2"] = k2
+    T, N, t, n = [df[column].to_numpy(dtype=float)[:, None] for column in "TNtn"]
+
+    df["seq_scan_cost"] = seq_scan_cost(T[:, 0], N[:, 0], k1, params)
+    best_case, worst_case = index_scan_cost(
+        selectivities[None, :], T, N, b, t, n, k1, k2, params
+    )
+    # without statistics on the column, assume the worst case
+    correlation = df["correlation"].fillna(0).to_numpy(dtype=float)[:, None]
+    estimated_cost = index_scan_cost_correlated(
+        selectivities[None, :], T, N, b, t, n, k1, k2, correlation, params
+    )
+    speedup = cluster_speedup(
+        selectivities[None, :], T, N, b, t, n, k1, k2, correlation, params
+    )
+    for i, s in enumerate(selectivities):
+        df[f"index_cost_best_s={s:g}"] = best_case[:, i]
+        df[f"index_cost_worst_s={s:g}"] = worst_case[:, i]
+        df[f"index_cost_s={s:g}"] = estimated_cost[:, i]
+        df[f"cluster_speedup_s={s:g}"] = speedup[:, i]
+    return crossover_table(df, b, params)
+
+
+def run_catalog_evaluation(
+    schemas: Optional[List[str]] = None,
+    selectivities: Optional[List[float]] = None,
+    output: Optional[str] = "./catalog_costs.csv",
+) -> pd.DataFrame:
+    connection = connect_db()
+    cursor = connection.cursor()
+    df_indexes, settings = collect_catalog(cursor, schemas)
+    connection.close()
+
+    # effective_cache_size is the cache size the planner gives to index_pages_fetched
+    b = settings["effective_cache_size"]
+    print_log(
+        f"{len(df_indexes)} indexes, shared_buffers={settings['shared_buffers']:.0f} pages, effective_cache_size={b:.0f} pages"
+    )
+    df = evaluate_catalog(
+        df_indexes, b, cost_parameters_from_settings(settings), selectivities
+    )
+    df["shared_buffers"] = settings["shared_buffers"]
+    df["effective_cache_size"] = b
+    df.to_csv(output, index=False)
+    return df
+
+
+if __name__ == "__main__":
+    df_catalog = run_catalog_evaluation()
+    print(
+        df_catalog[
+            [
+                "table_name",
+                "index_name",
+                "column_name",
+                "correlation",
+                "crossover_best_case",
+                "crossover_worst_case",
+            ]
+        ].to_string(index=False)
+    )
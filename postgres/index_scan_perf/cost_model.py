@@ -0,0 +1,154 @@
+from typing import TypedDict
+import numpy as np
+
+
+class PlannerCostParameters(TypedDict):
+    seq_page_cost: float
+    random_page_cost: float
+    cpu_tuple_cost: float
+    cpu_index_tuple_cost: float
+    cpu_operator_cost: float
+
+
+class CostParameters(PlannerCostParameters, total=False):
+    # set by calibration: execution time of one cost unit
+    ms_per_cost_unit: float
+
+
+# PostgreSQL defaults of the planner cost GUCs
+SEQ_PAGE_COST = 1.0
+RANDOM_PAGE_COST = 4.0
+CPU_TUPLE_COST = 0.01
+CPU_INDEX_TUPLE_COST = 0.005
+CPU_OPERATOR_COST = 0.0025
+
+DEFAULT_COST_PARAMETERS: CostParameters = {
+    "seq_page_cost": SEQ_PAGE_COST,
+    "random_page_cost": RANDOM_PAGE_COST,
+    "cpu_tuple_cost": CPU_TUPLE_COST,
+    "cpu_index_tuple_cost": CPU_INDEX_TUPLE_COST,
+    "cpu_operator_cost": CPU_OPERATOR_COST,
+}
+
+
+# s: selectivity, T: table pages, N: table tuples, b: cache pages (effective_cache_size),
+# t: index pages, n: index tuples, k1/k2: operators in the filter / in the index condition,
+# correlation: pg_stats.correlation of the indexed column.
+# Every argument can be a NumPy array, they are broadcast against each other.
+
+
+def pages_fetched_best_case(s, T):
+    return np.multiply(s, T)
+
+
+def pages_fetched_worst_case(s, T, N, b):
+    # Mackert-Lohman approximation used by index_pages_fetched in costsize.c
+    s, T, N, b = np.broadcast_arrays(*map(np.asarray, (s, T, N, b)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fetched = 2 * T * N * s / (2 * T + N * s)
+        limit = 2 * T * b / (N * (2 * T - b))
+        beyond_limit = b + (N * s - 2 * T * b / (2 * T - b)) * (T - b) / T
+    return np.where(
+        T <= b,
+        np.minimum(fetched, T),
+        np.where(s <= limit, fetched, beyond_limit),
+    )
+
+
+def seq_scan_cost(T, N, k1, params: CostParameters = DEFAULT_COST_PARAMETERS):
+    return (
+        params["cpu_tuple_cost"] + params["cpu_operator_cost"] * np.asarray(k1)
+    ) * N + params["seq_page_cost"] * np.asarray(T)
+
+
+def index_scan_cost_components(
+    s, T, N, b, t, n, k1, k2, params: CostParameters = DEFAULT_COST_PARAMETERS
+) -> dict:
+    s = np.asarray(s, dtype=float)
+    return {
+        "index_cpu_cost": (
+            params["cpu_index_tuple_cost"]
+            + np.asarray(k2) * params["cpu_operator_cost"]
+        )
+        * s
+        * n,
+        "index_io_cost": params["random_page_cost"] * s * t,
+        "table_cpu_cost": (
+            params["cpu_tuple_cost"]
+            + (np.asarray(k1) - k2) * params["cpu_operator_cost"]
+        )
+        * s
+        * N,
+        "table_io_cost_best": params["seq_page_cost"] * pages_fetched_best_case(s, T),
+        "table_io_cost_worst": params["random_page_cost"]
+        * pages_fetched_worst_case(s, T, N, b),
+    }
+
+
+def index_scan_cost(
+    s, T, N, b, t, n, k1, k2, params: CostParameters = DEFAULT_COST_PARAMETERS
+):
+    # returns the best case (correlation 1) and worst case (correlation 0) costs
+    components = index_scan_cost_components(s, T, N, b, t, n, k1, k2, params)
+    common_cost = (
+        components["index_cpu_cost"]
+        + components["index_io_cost"]
+        + components["table_cpu_cost"]
+    )
+    return (
+        common_cost + components["table_io_cost_best"],
+        common_cost + components["table_io_cost_worst"],
+    )
+
+
+def interpolate_by_correlation(best_case, worst_case, correlation):
+    # cost_index in costsize.c: worst + correlation^2 * (best - worst)
+    correlation_squared = np.square(correlation)
+    return worst_case + correlation_squared * (best_case - worst_case)
+
+
+def pages_fetched_correlated(s, T, N, b, correlation):
+    return interpolate_by_correlation(
+        pages_fetched_best_case(s, T), pages_fetched_worst_case(s, T, N, b), correlation
+    )
+
+
+def index_scan_cost_correlated(
+    s,
+    T,
+    N,
+    b,
+    t,
+    n,
+    k1,
+    k2,
+    correlation,
+    params: CostParameters = DEFAULT_COST_PARAMETERS,
+):
+    best_case, worst_case = index_scan_cost(s, T, N, b, t, n, k1, k2, params)
+    return interpolate_by_correlation(best_case, worst_case, correlation)
+
+
+def cluster_speedup(
+    s,
+    T,
+    N,
+    b,
+    t,
+    n,
+    k1,
+    k2,
+    correlation,
+    params: CostParameters = DEFAULT_COST_PARAMETERS,
+):
+    # CLUSTER brings the correlation to 1: ratio of the index scan cost before and after
+    best_case, worst_case = index_scan_cost(s, T, N, b, t, n, k1, k2, params)
+    return interpolate_by_correlation(best_case, worst_case, correlation) / best_case
+
+
+def pages_fetched_grid(xs, xb, xT, tuples_per_page):
+    # worst case pages fetched over selectivity x cache size x table size, in one call
+    xs = np.asarray(xs, dtype=float)[:, None, None]
+    xb = np.asarray(xb, dtype=float)[None, :, None]
+    xT = np.asarray(xT, dtype=float)[None, None, :]
+    return pages_fetched_worst_case(xs, xT, xT * tuples_per_page, xb)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from cost_model import (
+    DEFAULT_COST_PARAMETERS,
+    CostParameters,
+    index_scan_cost,
+    index_scan_cost_components,
+    seq_scan_cost,
+)
+
+
+# the crossover is the selectivity above which a seq scan is cheaper than the index scan,
+# 1.0 means the index scan stays cheaper up to the whole table
+
+
+def validate_table_stats(T, N, t, n):
+    # relpages / reltuples are 0 for an empty table and reltuples is -1 (or NaN once
+    # NULLIF'd) for a table never analyzed: the cost formulas divide by them
+    for name, value in [("T", T), ("N", N), ("t", t), ("n", n)]:
+        value = np.asarray(value, dtype=float)
+        if not np.all(np.isfinite(value) & (value > 0)):
+            raise ValueError(
+                f"{name} must be positive, got {value}: run ANALYZE on the table or skip empty tables"
+            )
+
+
+def crossover_best_case(
+    T, N, t, n, k1, k2, params: CostParameters = DEFAULT_COST_PARAMETERS
+):
+    validate_table_stats(T, N, t, n)
+    # every term of the best case index cost is proportional to s
+    components = index_scan_cost_components(1.0, T, N, 0, t, n, k1, k2, params)
+    cost_per_selectivity = (
+        components["index_cpu_cost"]
+        + components["index_io_cost"]
+        + components["table_cpu_cost"]
+        + components["table_io_cost_best"]
+    )
+    return np.minimum(seq_scan_cost(T, N, k1, params) / cost_per_selectivity, 1.0)
+
+
+def crossover_worst_case(
+    T,
+    N,
+    b,
+    t,
+    n,
+    k1,
+    k2,
+    params: CostParameters = DEFAULT_COST_PARAMETERS,
+    nb_iterations: int = 60,
+):
+    # the worst case index cost grows with s, bisect on every table at once
+    validate_table_stats(T, N, t, n)
+    T, N, b, t, n, k1, k2 = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (T, N, b, t, n, k1, k2)]
+    )
+    seq_cost = seq_scan_cost(T, N, k1, params)
+
+    def index_cost_worst(s):
+        return index_scan_cost(s, T, N, b, t, n, k1, k2, params)[1]
+
+    low = np.zeros(T.shape)
+    high = np.ones(T.shape)
+    for _ in range(nb_iterations):
+        middle = (low + high) / 2
+        index_cheaper = index_cost_worst(middle) < seq_cost
+        low = np.where(index_cheaper, middle, low)
+        high = np.where(index_cheaper, high, middle)
+    return np.where(index_cost_worst(1.0) < seq_cost, 1.0, high)
+
+
+def crossover_table(
+    df_tables: pd.DataFrame,
+    b,
+    params: CostParameters = DEFAULT_COST_PARAMETERS,
+) -> pd.DataFrame:
+    # df_tables: one row per table/index with the columns T, N, t, n, k1, k2
+    df = df_tables.copy()
+    T, N, t, n, k1, k2 = [
+        df[column].to_numpy(dtype=float) for column in ["T", "N", "t", "n", "k1", "k2"]
+    ]
+    df["crossover_best_case"] = crossover_best_case(T, N, t, n, k1, k2, params)
+    df["crossover_worst_case"] = crossover_worst_case(T, N, b, t, n, k1, k2, params)
+    return df
+
+
+if __name__ == "__main__":
+    df_tables = pd.DataFrame(
+        [
+            ["table_1", 161984, 14838350, 18663, 14838350, 2, 1],
+            ["table_2", 252687, 36233108, 30663, 36233108, 1, 1],
+        ],
+        columns=["table_name", "T", "N", "t", "n", "k1", "k2"],
+    )
+    for b in [524288, 131072]:
+        print(f"Cache size: {b} pages")
+        print(crossover_table(df_tables, b).to_string(index=False))
@@ -1,33 +1,47 @@
 import numpy as np
 from matplotlib import pylab as plt
 
+from buffer_simulator import simulate_pages_fetched
+from cost_model import (
+    index_scan_cost,
+    index_scan_cost_components,
+    pages_fetched_best_case,
+    pages_fetched_correlated,
+    pages_fetched_worst_case,
+    seq_scan_cost,
+)
+
 
 def compute_pages_to_fetch_best_case(s, T):
-    return s * T
+    return pages_fetched_best_case(s, T)
 
 
 def compute_pages_to_fetch_worst_case(s, T, N, b):
-    if T <= b:
-        # print("1")
-        a = 2 * T * N * s / (2 * T + N * s)
-        return min(a, T)
-    if s <= 2 * T * b / (N * (2 * T - b)):
-        # print("2")
-        return 2 * T * N * s / (2 * T + N * s)
-
-    # print("3")
-    return b + (N * s - 2 * T * b / (2 * T - b)) * (T - b) / T
+    return pages_fetched_worst_case(s, T, N, b)
 
 
-def draw_pages_fetched_chart(T, N, b, scenario):
+def draw_pages_fetched_chart(
+    T, N, b, scenario, simulated_xs=None, policies=("lru", "clock_sweep")
+):
     xs = np.arange(0, 1, 0.01)
-    pages_to_fetch_best_case = [compute_pages_to_fetch_best_case(s, T) for s in xs]
-    pages_to_fetch_worst_case = [
-        compute_pages_to_fetch_worst_case(s, T, N, b) for s in xs
-    ]
+    pages_to_fetch_best_case = compute_pages_to_fetch_best_case(xs, T)
+    pages_to_fetch_worst_case = compute_pages_to_fetch_worst_case(xs, T, N, b)
     plt.figure(figsize=(12, 6))
     plt.plot(xs, pages_to_fetch_best_case, label="high_correlation")
     plt.plot(xs, pages_to_fetch_worst_case, label="low_correlation")
+    # misses of a b pages cache replaying the heap accesses of the index scan
+    if simulated_xs is not None:
+        for policy, marker in zip(policies, ["o", "x"]):
+            for correlation, name in [(1, "high"), (0, "low")]:
+                pages = simulate_pages_fetched(
+                    T, N, b, simulated_xs, correlation, policy, seed=0
+                )
+                plt.plot(
+                    np.sort(simulated_xs),
+                    pages,
+                    marker,
+                    label=f"{name}_correlation_simulated_{policy}",
+                )
     plt.xlabel("Selectivity")
     plt.ylabel("Number of pages to fetch")
     scenario_title = (" ".join(scenario.split("_"))).capitalize()
@@ -38,62 +52,45 @@ def draw_pages_fetched_chart(T, N, b, scenario):
     plt.savefig(f"./pages_to_fetch_{scenario}.png")
 
 
+def draw_pages_fetched_by_correlation_chart(
+    T, N, b, scenario, correlations=(0, 0.5, 0.8, 0.9, 0.95, 1)
+):
+    xs = np.arange(0, 1, 0.01)
+    correlations = np.asarray(correlations)
+    # one curve per correlation, evaluated as a selectivity x correlation grid
+    pages = pages_fetched_correlated(xs[:, None], T, N, b, correlations[None, :])
+    plt.figure(figsize=(12, 6))
+    for i, correlation in enumerate(correlations):
+        plt.plot(xs, pages[:, i], label=f"correlation={correlation:g}")
+    plt.xlabel("Selectivity")
+    plt.ylabel("Number of pages to fetch")
+    scenario_title = (" ".join(scenario.split("_"))).capitalize()
+    plt.title(f"Number of pages to fetch by correlation - {scenario_title} ")
+    plt.legend(loc="center right")
+    plt.savefig(f"./pages_to_fetch_by_correlation_{scenario}.png")
+
+
 def get_plot_by_selectivity(func, xs, T, N, b):
-    ys = []
-    for x in xs:
-        ys.append(func(x, T, N, b))
-    ys = np.array(ys)
-    plt.plot(xs, ys)
+    plt.plot(xs, func(np.asarray(xs), T, N, b))
     plt.show()
 
 
 def get_plot_by_cache_size(func, xb, T, N, s):
-    yb = []
-    for b in xb:
-        yb.append(func(s, T, N, b))
-    yb = np.array(yb)
-    plt.plot(xb, yb)
+    plt.plot(xb, func(s, T, N, np.asarray(xb)))
     plt.show()
 
 
 def get_plot_by_table_size(func, xT, xN, s, b):
-    yT = []
-    for i in range(0, len(xT)):
-        yT.append(func(s, xT[i], xN[i], b))
-    yT = np.array(yT)
-    plt.plot(xT, yT)
+    plt.plot(xT, func(s, np.asarray(xT), np.asarray(xN), b))
     plt.show()
 
 
 def get_plot_seq_index(xs, T, N, b, t, n, k1, k2, scenario):
-    seqcosts = []
-    for _ in xs:
-        seqcosts.append((0.01 + 0.0025 * k1) * N + T)
-    seqcosts = np.array(seqcosts)
+    seqcosts = np.full(len(xs), seq_scan_cost(T, N, k1))
     plt.figure(figsize=(12, 6))
     plt.plot(xs, seqcosts, label="seq_scan")
 
-    indexcosts_best = []
-    indexcosts_worst = []
-    for s in xs:
-        index_space_cost = (0.005 + k2 * 0.0025) * s * n + 4 * s * t
-
-        table_space_cost_best = (0.01 + (k1 - k2) * 0.0025) * s * N + s * T
-        indexcosts_best.append(index_space_cost + table_space_cost_best)
-
-        if T <= b:
-            a = 2 * T * N * s / (2 * T + N * s)
-            table_space_cost_worst = 4 * min(a, T)
-
-        elif s <= 2 * T * b / (N * (2 * T - b)):
-            table_space_cost_worst = 8 * T * N * s / (2 * T + N * s)
-        else:
-            table_space_cost_worst = 4 * (
-                b + (N * s - 2 * T * b / (2 * T - b)) * (T - b) / T
-            )
-        table_space_cost_worst += (0.01 + (k1 - k2) * 0.0025) * s * N
-        indexcosts_worst.append(index_space_cost + table_space_cost_worst)
-
+    indexcosts_best, indexcosts_worst = index_scan_cost(xs, T, N, b, t, n, k1, k2)
     plt.plot(xs, indexcosts_best, label="index_scan_best_case")
     plt.plot(xs, indexcosts_worst, label="index_scan_worst_case")
     plt.xlabel("Selectivity")
@@ -103,32 +100,13 @@ def get_plot_seq_index(xs, T, N, b, t, n, k1, k2, scenario):
 
 
 def compute_cost(xs, T, N, b, t, n, k1, k2):
-    index_cpu_cost = []
-    index_IO_cost = []
-    table_cpu_cost = []
-    table_IO_cost_worst = []
-    table_IO_cost_best = []
-
-    for s in xs:
-        index_cpu_cost.append((0.005 + k2 * 0.0025) * s * n)
-        index_IO_cost.append(4 * s * t)
-        table_cpu_cost.append((0.01 + (k1 - k2) * 0.0025) * s * N)
-        table_IO_cost_best.append(s * T)
-
-        if T <= b:
-            a = 2 * T * N * s / (2 * T + N * s)
-            IO_cost = 4 * min(a, T)
-        elif s <= 2 * T * b / (N * (2 * T - b)):
-            IO_cost = 8 * T * N * s / (2 * T + N * s)
-        else:
-            IO_cost = 4 * (b + (N * s - 2 * T * b / (2 * T - b)) * (T - b) / T)
-        table_IO_cost_worst.append(IO_cost)
+    components = index_scan_cost_components(xs, T, N, b, t, n, k1, k2)
     return (
-        index_cpu_cost,
-        index_IO_cost,
-        table_cpu_cost,
-        table_IO_cost_worst,
-        table_IO_cost_best,
+        components["index_cpu_cost"],
+        components["index_io_cost"],
+        components["table_cpu_cost"],
+        components["table_io_cost_worst"],
+        components["table_io_cost_best"],
     )
 
 
@@ -153,19 +131,13 @@ def get_plot_index_breakdown(cost, scenario):
         (table_IO_cost_worst, "Table IO Cost Worst"),
     ]
 
-    cumulated = []
-    last_cumulated = []
+    cumulated = np.zeros(len(series[0][0]))
     for i in range(0, len(series)):
         data, label = series[i]
         color = colors[i]
 
-        if i == 0:
-            last_cumulated = [0 for _ in range(len(data))]
-            cumulated = [0 for _ in range(len(data))]
-        else:
-            last_cumulated = [elem for elem in cumulated]
-
-        cumulated = [cumulated[i] + data[i] for i in range(len(data))]
+        last_cumulated = cumulated
+        cumulated = cumulated + data
         plt.plot(
             cumulated,
             label=label,
@@ -195,19 +167,13 @@ def get_plot_index_breakdown(cost, scenario):
         (table_cpu_cost, "Table CPU Cost"),
         (table_IO_cost_best, "Table IO Cost Best"),
     ]
-    cumulated = []
-    last_cumulated = []
+    cumulated = np.zeros(len(series[0][0]))
     for i in range(0, len(series)):
         data, label = series[i]
         color = colors[i]
 
-        if i == 0:
-            last_cumulated = [0 for _ in range(len(data))]
-            cumulated = [0 for _ in range(len(data))]
-        else:
-            last_cumulated = [elem for elem in cumulated]
-
-        cumulated = [cumulated[i] + data[i] for i in range(len(data))]
+        last_cumulated = cumulated
+        cumulated = cumulated + data
         plt.plot(
             cumulated,
             label=label,
@@ -344,8 +310,12 @@ def get_plot_index_breakdown(cost, scenario):
 T = 161984
 N = 14838350
 b = 524288
-draw_pages_fetched_chart(T, N, b, "table_fit_in_cache")
+draw_pages_fetched_chart(
+    T, N, b, "table_fit_in_cache", simulated_xs=np.arange(0.05, 1, 0.1)
+)
 T1 = 161984
 N1 = 14838350
 b1 = 131072
-draw_pages_fetched_chart(T1, N1, b1, "table_bigger_than_cache")
+draw_pages_fetched_chart(
+    T1, N1, b1, "table_bigger_than_cache", simulated_xs=np.arange(0.05, 1, 0.1)
+)
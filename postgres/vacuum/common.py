@@ -0,0 +1,39 @@
+import os
+import psycopg2
+import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def print_log(message: str) -> None:
+    current_timestamp = datetime.datetime.now(datetime.timezone.utc)
+    formatted_timestamp = current_timestamp.strftime("%d-%m-%y %H:%M:%S.%fZ")
+    print(f"[{formatted_timestamp}] {message}")
+
+
+def connect_db():
+    try:
+        connection = psycopg2.connect(
+            host="localhost",
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+        )
+        print_log("Connected to db!")
+        return connection
+    except psycopg2.Error as e:
+        print_log(f"Error connecting to database: {e}")
+        exit(1)
+
+
+def capture_table_size(cursor, table_name: str):
+    cursor.execute(f"SELECT pg_relation_size('{table_name}');")
+    table_size = cursor.fetchone()
+    return table_size[0] / (1024 * 1024)
+
+
+def capture_index_size(cursor, table_name: str):
+    cursor.execute(f"SELECT pg_indexes_size('{table_name}');")
+    table_size = cursor.fetchone()
+    return table_size[0] / (1024 * 1024)
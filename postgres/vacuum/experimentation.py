@@ -1,214 +1,195 @@
-import os
-from time import sleep
-from typing import Literal
-import psycopg2
-import datetime
+from typing import List, Literal
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
-from dotenv import load_dotenv
 
-load_dotenv()
-
-
-def print_log(message: str) -> None:
-    current_timestamp = datetime.datetime.now(datetime.timezone.utc)
-    formatted_timestamp = current_timestamp.strftime("%d-%m-%y %H:%M:%S.%fZ")
-    print(f"[{formatted_timestamp}] {message}")
+from common import print_log
+from scenario import (
+    ScenarioResult,
+    Step,
+    create_step,
+    delete_step,
+    index_step,
+    insert_step,
+    measure_step,
+    ranges_predicate,
+    reindex_step,
+    run_scenario,
+    update_step,
+    vacuum_step,
+)
 
 
-def connect_db():
-    try:
-        connection = psycopg2.connect(
-            host="localhost",
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-        )
-        print_log("Connected to db!")
-        return connection
-    except psycopg2.Error as e:
-        print_log(f"Error connecting to database: {e}")
-        exit(1)
+def middle_ranges(nb_rows: int) -> List[tuple]:
+    return [(nb_rows // 5, nb_rows * 9 // 20), (nb_rows * 7 // 10, nb_rows * 19 // 20)]
 
 
-def experimentation_vacuum(*, where_to_delete=Literal["middle", "end"]):
-    table_size = {}
+def experimentation_vacuum(
+    *, where_to_delete=Literal["middle", "end"], nb_rows: int = 100_000
+):
     print_log(
         f"Running experimentation of VACUUM command. Delete rows at the {where_to_delete} of the table."
     )
-    connection = connect_db()
-    cursor = connection.cursor()
-
-    cursor.execute("DROP TABLE IF EXISTS test;")
-    cursor.execute("CREATE TABLE test (id int8);")
-    cursor.execute("ALTER TABLE test SET (autovacuum_enabled = false);")
-    cursor.execute("INSERT INTO test (SELECT * FROM GENERATE_SERIES(1, 100000));")
-    connection.commit()
-    table_size["after initial insertion"] = capture_table_size(cursor, "test")
-    print_log(f"Table size : {table_size['after initial insertion']}")
-
-    delete_sql_middle = "DELETE FROM test WHERE (id >= 20000 AND id <= 45000) OR (id >= 70000 AND id <= 95000);"
-    delete_sql_end = "DELETE FROM test WHERE id > 50000;"
-    delete_sql = delete_sql_middle if where_to_delete == "middle" else delete_sql_end
-    cursor.execute(delete_sql)
-    connection.commit()
-    table_size["after deletion"] = capture_table_size(cursor, "test")
-    print_log(f"Table size after delete: {table_size['after deletion']}")
-
-    connection.set_isolation_level(0)
-    cursor.execute("VACUUM test;")
-    sleep(5)
-    table_size["after vacuum"] = capture_table_size(cursor, "test")
-    print_log(f"Table size after vacuum: {table_size['after vacuum']}")
-
-    cursor.execute("INSERT INTO test (SELECT * FROM GENERATE_SERIES(100001, 150000));")
-    connection.commit()
-    table_size["after insertion 1"] = capture_table_size(cursor, "test")
-    print_log(f"Table size after inserting 1: {table_size['after insertion 1']}")
-
-    cursor.execute("INSERT INTO test (SELECT * FROM GENERATE_SERIES(150001, 160001));")
-    connection.commit()
-    table_size["after insertion 2"] = capture_table_size(cursor, "test")
-    print_log(f"Table size after inserting 2: {table_size['after insertion 2']}")
-
-    return table_size
-
-
-def experimentation_vacuum_index_cleanup_delete_rows(*, reinsert_same_data: bool):
-    index_size = {}
-    print_log(
-        f"Running experimentation of VACUUM command with INDEX_CLEANUP. Delete rows then insert the {'same' if reinsert_same_data else 'different'} data."
+    delete_where = (
+        ranges_predicate(middle_ranges(nb_rows))
+        if where_to_delete == "middle"
+        else f"id > {nb_rows // 2}"
+    )
+    result = run_scenario(
+        [
+            create_step(),
+            insert_step(1, nb_rows),
+            measure_step("after initial insertion"),
+            delete_step(delete_where),
+            measure_step("after deletion"),
+            vacuum_step(),
+            measure_step("after vacuum"),
+            insert_step(nb_rows + 1, nb_rows * 3 // 2),
+            measure_step("after insertion 1"),
+            insert_step(nb_rows * 3 // 2 + 1, nb_rows * 8 // 5 + 1),
+            measure_step("after insertion 2"),
+        ]
     )
-    connection = connect_db()
-    cursor = connection.cursor()
-
-    cursor.execute("DROP TABLE IF EXISTS test;")
-    cursor.execute("CREATE TABLE test (id int8);")
-    cursor.execute("ALTER TABLE test SET (autovacuum_enabled = false);")
-    cursor.execute("INSERT INTO test (SELECT * FROM GENERATE_SERIES(1, 100000));")
-    cursor.execute("CREATE INDEX ON test USING BTREE(id);")
-    connection.commit()
-    index_size["after initial insertion"] = capture_index_size(cursor, "test")
-    print_log(f"Index size : {index_size['after initial insertion']}")
 
-    delete_sql = "DELETE FROM test WHERE (id >= 20000 AND id <= 45000) OR (id >= 70000 AND id <= 95000);"
-    cursor.execute(delete_sql)
-    connection.commit()
-    index_size["after delete"] = capture_index_size(cursor, "test")
-    print_log(f"Index size after delete: {index_size['after delete']}")
+    return result["measures"]
 
-    connection.set_isolation_level(0)
-    cursor.execute("VACUUM (INDEX_CLEANUP ON) test;")
-    sleep(5)
-    index_size["after clean"] = capture_index_size(cursor, "test")
-    print_log(
-        f"Index size after vacuum with index clean up: {index_size['after clean']}"
-    )
 
+def index_cleanup_steps(
+    maintenance_step: Step, reinsert_same_data: bool, nb_rows: int
+) -> List[Step]:
     if reinsert_same_data:
-        cursor.execute(
-            "INSERT INTO test (SELECT * FROM GENERATE_SERIES(20000, 45000));"
-        )
-        cursor.execute(
-            "INSERT INTO test (SELECT * FROM GENERATE_SERIES(70000, 95000));"
-        )
+        reinsert_steps = [
+            insert_step(start, end) for start, end in middle_ranges(nb_rows)
+        ]
     else:
-        cursor.execute(
-            "INSERT INTO test (SELECT * FROM GENERATE_SERIES(100001, 150001));"
+        reinsert_steps = [insert_step(nb_rows + 1, nb_rows * 3 // 2 + 1)]
+
+    return [
+        create_step(),
+        insert_step(1, nb_rows),
+        index_step(),
+        measure_step("after initial insertion", "index"),
+        delete_step(ranges_predicate(middle_ranges(nb_rows))),
+        measure_step("after delete", "index"),
+        maintenance_step,
+        measure_step("after clean", "index"),
+        *reinsert_steps,
+        measure_step("after reinsert", "index"),
+    ]
+
+
+def experimentation_vacuum_index_cleanup_delete_rows(
+    *, reinsert_same_data: bool, nb_rows: int = 100_000
+):
+    print_log(
+        f"Running experimentation of VACUUM command with INDEX_CLEANUP. Delete rows then insert the {'same' if reinsert_same_data else 'different'} data."
+    )
+    result = run_scenario(
+        index_cleanup_steps(
+            vacuum_step("INDEX_CLEANUP ON"), reinsert_same_data, nb_rows
         )
+    )
 
-    connection.commit()
-    index_size["after reinsert"] = capture_index_size(cursor, "test")
-    print_log(f"Index size after inserting: {index_size['after reinsert'] }")
-
-    return index_size
+    return result["measures"]
 
 
-def experimentation_vacuum_index_cleanup_update_rows():
+def experimentation_vacuum_index_cleanup_update_rows(nb_rows: int = 100_000):
     print_log(
         f"Running experimentation of VACUUM command with INDEX_CLEANUP. Modify rows."
     )
-    connection = connect_db()
-    cursor = connection.cursor()
-
-    cursor.execute("DROP TABLE IF EXISTS test;")
-    cursor.execute("CREATE TABLE test (id int8);")
-    cursor.execute("ALTER TABLE test SET (autovacuum_enabled = false);")
-    cursor.execute("INSERT INTO test (SELECT * FROM GENERATE_SERIES(1, 100000));")
-    cursor.execute("CREATE INDEX ON test USING BTREE(id);")
-    connection.commit()
-    print_log(f"Index size : {capture_index_size(cursor, 'test')}")
-
-    update_sql = "UPDATE test SET id = id * 10 WHERE (id >= 20000 AND id <= 45000) OR (id >= 70000 AND id <= 95000);"
-    cursor.execute(update_sql)
-    connection.commit()
-    print_log(f"Index size after update: {capture_index_size(cursor, 'test')}")
-
-    connection.set_isolation_level(0)
-    cursor.execute("VACUUM (INDEX_CLEANUP ON) test;")
-    sleep(5)
-    print_log(
-        f"Index size after vacuum with index clean up: {capture_index_size(cursor, 'test')}"
+    result = run_scenario(
+        [
+            create_step(),
+            insert_step(1, nb_rows),
+            index_step(),
+            measure_step("after initial insertion", "index"),
+            update_step("id = id * 10", ranges_predicate(middle_ranges(nb_rows))),
+            measure_step("after update", "index"),
+            vacuum_step("INDEX_CLEANUP ON"),
+            measure_step("after clean", "index"),
+        ]
     )
 
+    return result["measures"]
 
-def experimentation_reindex(*, reinsert_same_data: bool):
-    index_size = {}
-    print_log(f"Running experimentation of REINDEX command.")
-    connection = connect_db()
-    cursor = connection.cursor()
-
-    cursor.execute("DROP TABLE IF EXISTS test;")
-    cursor.execute("CREATE TABLE test (id int8);")
-    cursor.execute("ALTER TABLE test SET (autovacuum_enabled = false);")
-    cursor.execute("INSERT INTO test (SELECT * FROM GENERATE_SERIES(1, 100000));")
-    cursor.execute("CREATE INDEX ON test USING BTREE(id);")
-    connection.commit()
-    index_size["after initial insertion"] = capture_index_size(cursor, "test")
-    print_log(f"Index size : {index_size['after initial insertion']}")
-
-    delete_sql = "DELETE FROM test WHERE (id >= 20000 AND id <= 45000) OR (id >= 70000 AND id <= 95000);"
-    cursor.execute(delete_sql)
-    connection.commit()
-    index_size["after delete"] = capture_index_size(cursor, "test")
-    print_log(f"Index size after delete: {index_size['after delete']}")
 
-    connection.set_isolation_level(0)
-    cursor.execute("REINDEX TABLE test;")
-    sleep(5)
-    index_size["after clean"] = capture_index_size(cursor, "test")
-    print_log(f"Index size after reindex: {index_size['after clean']}")
-
-    if reinsert_same_data:
-        cursor.execute(
-            "INSERT INTO test (SELECT * FROM GENERATE_SERIES(20000, 45000));"
-        )
-        cursor.execute(
-            "INSERT INTO test (SELECT * FROM GENERATE_SERIES(70000, 95000));"
-        )
-    else:
-        cursor.execute(
-            "INSERT INTO test (SELECT * FROM GENERATE_SERIES(100001, 150001));"
-        )
+def experimentation_reindex(*, reinsert_same_data: bool, nb_rows: int = 100_000):
+    print_log(f"Running experimentation of REINDEX command.")
+    result = run_scenario(
+        index_cleanup_steps(reindex_step(), reinsert_same_data, nb_rows)
+    )
 
-    connection.commit()
-    index_size["after reinsert"] = capture_index_size(cursor, "test")
-    print_log(f"Index size after inserting: {index_size['after reinsert'] }")
+    return result["measures"]
 
-    return index_size
 
+def inspection_vacuum(
+    *, where_to_delete=Literal["middle", "end"], nb_rows: int = 100_000
+) -> ScenarioResult:
+    print_log(
+        f"Running inspection of VACUUM command. Delete rows at the {where_to_delete} of the table."
+    )
+    delete_where = (
+        ranges_predicate(middle_ranges(nb_rows))
+        if where_to_delete == "middle"
+        else f"id > {nb_rows // 2}"
+    )
+    return run_scenario(
+        [
+            create_step(),
+            insert_step(1, nb_rows),
+            index_step(),
+            delete_step(delete_where),
+            vacuum_step(),
+            insert_step(nb_rows + 1, nb_rows * 3 // 2),
+        ],
+        inspect=True,
+    )
 
-def capture_table_size(cursor, table_name: str):
-    cursor.execute(f"SELECT pg_relation_size('{table_name}');")
-    table_size = cursor.fetchone()
-    return table_size[0] / (1024 * 1024)
 
+def draw_inspection_heatmap(title, result: ScenarioResult):
+    labels = [
+        f"{inspection['step']} {inspection['kind']}"
+        for inspection in result["inspections"]
+    ]
+    df_free_space = pd.DataFrame(
+        [inspection["free_space"] for inspection in result["inspections"]],
+        index=labels,
+    )
+    df_metrics = pd.DataFrame(
+        [
+            {
+                "dead tuple %": inspection["table"]["dead_tuple_percent"],
+                "free %": inspection["table"]["free_percent"],
+                **{
+                    f"{index['index_name']} leaf density %": index["avg_leaf_density"]
+                    for index in inspection["indexes"]
+                },
+                **{
+                    f"{index['index_name']} fragmentation %": index[
+                        "leaf_fragmentation"
+                    ]
+                    for index in inspection["indexes"]
+                },
+            }
+            for inspection in result["inspections"]
+        ],
+        index=labels,
+    )
 
-def capture_index_size(cursor, table_name: str):
-    cursor.execute(f"SELECT pg_indexes_size('{table_name}');")
-    table_size = cursor.fetchone()
-    return table_size[0] / (1024 * 1024)
+    fig, axes = plt.subplots(
+        1, 2, figsize=(16, 6), gridspec_kw={"width_ratios": [3, 2]}
+    )
+    sns.heatmap(df_free_space, vmin=0, vmax=1, cmap="viridis", ax=axes[0])
+    axes[0].set_title("Free space per page (FSM)")
+    axes[0].set_xlabel("Position in the relation")
+    sns.heatmap(df_metrics, annot=True, fmt=".0f", cmap="rocket_r", ax=axes[1])
+    axes[1].set_title("pgstattuple / pgstatindex")
+    for ax in axes:
+        ax.tick_params(axis="y", rotation=0)
+    fig.suptitle(title)
+    plt.tight_layout()
+    plt.savefig(f"result/{title}.png")
+    plt.close(fig)
 
 
 def draw_chart(title, kind: Literal["bar", "line"], list_scenario, list_data):
@@ -289,3 +270,11 @@ draw_chart(
         index_size_reindex_reinsert_new_data,
     ],
 )
+draw_inspection_heatmap(
+    "Page inspection - VACUUM - Delete rows at the middle",
+    inspection_vacuum(where_to_delete="middle"),
+)
+draw_inspection_heatmap(
+    "Page inspection - VACUUM - Delete rows at the end",
+    inspection_vacuum(where_to_delete="end"),
+)
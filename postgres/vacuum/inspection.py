@@ -0,0 +1,109 @@
+from typing import List, Optional, TypedDict
+
+
+class TableInspection(TypedDict):
+    approximate: bool
+    dead_tuple_percent: float
+    free_percent: float
+
+
+class IndexInspection(TypedDict):
+    index_name: str
+    leaf_pages: int
+    empty_pages: int
+    deleted_pages: int
+    avg_leaf_density: float
+    leaf_fragmentation: float
+
+
+class Inspection(TypedDict):
+    step: int
+    kind: str
+    table: TableInspection
+    indexes: List[IndexInspection]
+    free_space: List[Optional[float]]
+
+
+def create_extensions(cursor):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pgstattuple;")
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_freespacemap;")
+
+
+def inspect_table(
+    cursor, table_name: str, approximate_above: Optional[int] = 1024
+) -> TableInspection:
+    # pgstattuple reads every page, pgstattuple_approx skips the all-visible ones
+    # using the visibility map, which keeps inspection cheap on large tables
+    cursor.execute(f"SELECT pg_relation_size('{table_name}');")
+    approximate = cursor.fetchone()[0] / (1024 * 1024) > approximate_above
+    if approximate:
+        cursor.execute(
+            f"SELECT dead_tuple_percent, approx_free_percent FROM pgstattuple_approx('{table_name}'::regclass);"
+        )
+    else:
+        cursor.execute(
+            f"SELECT dead_tuple_percent, free_percent FROM pgstattuple('{table_name}'::regclass);"
+        )
+    dead_tuple_percent, free_percent = cursor.fetchone()
+    return {
+        "approximate": approximate,
+        "dead_tuple_percent": dead_tuple_percent,
+        "free_percent": free_percent,
+    }
+
+
+def inspect_indexes(cursor, table_name: str) -> List[IndexInspection]:
+    cursor.execute(
+        f"""SELECT c.relname, s.leaf_pages, s.empty_pages, s.deleted_pages,
+            s.avg_leaf_density, s.leaf_fragmentation
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam AND am.amname = 'btree'
+        CROSS JOIN LATERAL pgstatindex(i.indexrelid::regclass) s
+        WHERE i.indrelid = '{table_name}'::regclass"""
+    )
+    return [
+        {
+            "index_name": index_name,
+            "leaf_pages": leaf_pages,
+            "empty_pages": empty_pages,
+            "deleted_pages": deleted_pages,
+            "avg_leaf_density": avg_leaf_density,
+            "leaf_fragmentation": leaf_fragmentation,
+        }
+        for index_name, leaf_pages, empty_pages, deleted_pages, avg_leaf_density, leaf_fragmentation in cursor.fetchall()
+    ]
+
+
+def capture_free_space_histogram(
+    cursor, table_name: str, nb_buckets: int = 50
+) -> List[Optional[float]]:
+    # average free fraction of the pages in each slice of the relation. The free space
+    # map is only updated by VACUUM, a DELETE alone leaves it untouched
+    cursor.execute(
+        f"""SELECT width_bucket(blkno, 0, GREATEST(pg_relation_size('{table_name}') / current_setting('block_size')::int, 1), {nb_buckets}) AS bucket,
+            avg(avail)::float / current_setting('block_size')::int
+        FROM pg_freespace('{table_name}'::regclass)
+        GROUP BY bucket"""
+    )
+    free_space = [None] * nb_buckets
+    for bucket, free_fraction in cursor.fetchall():
+        free_space[min(bucket, nb_buckets) - 1] = free_fraction
+    return free_space
+
+
+def inspect_relation(
+    cursor,
+    table_name: str,
+    step: int,
+    kind: str,
+    approximate_above: Optional[int] = 1024,
+    nb_buckets: int = 50,
+) -> Inspection:
+    return {
+        "step": step,
+        "kind": kind,
+        "table": inspect_table(cursor, table_name, approximate_above),
+        "indexes": inspect_indexes(cursor, table_name),
+        "free_space": capture_free_space_histogram(cursor, table_name, nb_buckets),
+    }
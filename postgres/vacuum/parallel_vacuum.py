@@ -0,0 +1,124 @@
+import itertools
+from typing import List, Optional
+import matplotlib.pyplot as plt
+import seaborn as sns
+import pandas as pd
+
+from common import print_log
+from progress import PhaseTiming
+from scenario import (
+    create_step,
+    delete_step,
+    index_step,
+    insert_step,
+    run_scenario,
+    set_step,
+    vacuum_step,
+)
+
+
+def count_index_vacuum_passes(phases: List[PhaseTiming]) -> int:
+    # index_vacuum_count only moves once a pass is over, so a pass still running at the
+    # last sample is counted from the phase changes instead
+    return max(
+        [phase["index_vacuum_count"] for phase in phases]
+        + [
+            sum(phase["phase"] == "vacuuming indexes" for phase in phases),
+        ]
+    )
+
+
+def benchmark_parallel_vacuum(
+    nb_indexes: int,
+    parallel: int,
+    maintenance_work_mem: str,
+    nb_rows: int = 10_000_000,
+    dead_fraction: float = 0.2,
+) -> dict:
+    # dead tuples are spread over every page, so each index has entries to remove
+    # everywhere. Indexes smaller than min_parallel_index_scan_size are vacuumed by the
+    # leader only, whatever the PARALLEL option
+    print_log(
+        f"Running parallel VACUUM benchmark: {nb_indexes} indexes, PARALLEL {parallel}, maintenance_work_mem {maintenance_work_mem}"
+    )
+    result = run_scenario(
+        [
+            create_step(nb_columns=nb_indexes),
+            insert_step(1, nb_rows),
+            *[index_step(f"c{i}") for i in range(1, nb_indexes + 1)],
+            delete_step(f"id % 1000 < {int(dead_fraction * 1000)}"),
+            set_step("maintenance_work_mem", maintenance_work_mem),
+            set_step("max_parallel_maintenance_workers", str(parallel)),
+            vacuum_step(f"PARALLEL {parallel}"),
+        ]
+    )
+    delete_timing = next(t for t in result["timings"] if t["kind"] == "delete")
+    vacuum_timing = result["timings"][-1]
+    dead_tuples = delete_timing["nb_rows"]
+
+    return {
+        "nb_indexes": nb_indexes,
+        "parallel": parallel,
+        "maintenance_work_mem": maintenance_work_mem,
+        "dead_tuples": dead_tuples,
+        "exec_time": vacuum_timing["exec_time"],
+        "index_vacuum_passes": count_index_vacuum_passes(vacuum_timing["phases"]),
+        "dead_tuples_per_second": dead_tuples / vacuum_timing["exec_time"],
+    }
+
+
+def sweep_parallel_vacuum(
+    list_nb_indexes: List[int],
+    list_parallel: List[int],
+    list_maintenance_work_mem: List[str],
+    nb_rows: int = 10_000_000,
+    dead_fraction: float = 0.2,
+    output: Optional[str] = "result/parallel_vacuum_sweep.csv",
+) -> pd.DataFrame:
+    df = pd.DataFrame(
+        [
+            benchmark_parallel_vacuum(
+                nb_indexes, parallel, maintenance_work_mem, nb_rows, dead_fraction
+            )
+            for nb_indexes, parallel, maintenance_work_mem in itertools.product(
+                list_nb_indexes, list_parallel, list_maintenance_work_mem
+            )
+        ]
+    )
+    df.to_csv(output, index=False)
+    return df
+
+
+def draw_sweep_chart(title, df: pd.DataFrame):
+    g = sns.catplot(
+        data=df,
+        x="parallel",
+        y="exec_time",
+        hue="maintenance_work_mem",
+        col="nb_indexes",
+        kind="bar",
+    )
+    g.set_axis_labels("VACUUM (PARALLEL n)", "VACUUM time (s)")
+    for ax, (_, df_indexes) in zip(g.axes.flat, df.groupby("nb_indexes")):
+        for container, (_, df_memory) in zip(
+            ax.containers, df_indexes.groupby("maintenance_work_mem", sort=False)
+        ):
+            ax.bar_label(
+                container,
+                labels=[
+                    f"{passes} pass" for passes in df_memory["index_vacuum_passes"]
+                ],
+                fontsize=8,
+            )
+    g.fig.suptitle(title)
+    plt.tight_layout()
+    plt.savefig(f"result/{title}.png")
+
+
+if __name__ == "__main__":
+    df_sweep = sweep_parallel_vacuum(
+        list_nb_indexes=[1, 4, 8],
+        list_parallel=[0, 2, 4],
+        list_maintenance_work_mem=["16MB", "64MB", "1GB"],
+    )
+    draw_sweep_chart("Parallel VACUUM sweep", df_sweep)
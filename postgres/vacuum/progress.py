@@ -0,0 +1,112 @@
+import threading
+import time
+from typing import List, Optional, TypedDict
+
+from common import connect_db
+
+
+PROGRESS_SQL = """
+SELECT 'vacuum' AS command, phase, heap_blks_scanned, heap_blks_vacuumed,
+    index_vacuum_count, 0 AS blocks_done, 0 AS tuples_done
+FROM pg_stat_progress_vacuum WHERE pid = %(pid)s
+UNION ALL
+SELECT 'create_index', phase, 0, 0, 0, blocks_done, tuples_done
+FROM pg_stat_progress_create_index WHERE pid = %(pid)s
+"""
+PROGRESS_COUNTERS = [
+    "heap_blks_scanned",
+    "heap_blks_vacuumed",
+    "index_vacuum_count",
+    "blocks_done",
+    "tuples_done",
+]
+
+
+class PhaseTiming(TypedDict):
+    command: str
+    phase: str
+    start: float
+    duration: float
+    heap_blks_scanned: int
+    heap_blks_vacuumed: int
+    index_vacuum_count: int
+    blocks_done: int
+    tuples_done: int
+    blocks_per_second: Optional[float]
+
+
+class ProgressMonitor(threading.Thread):
+    # polls the progress views for one backend from a second connection, so that a
+    # maintenance command is timed directly and split into its phases
+    def __init__(self, pid: int, interval: Optional[float] = 0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        # connect before the command starts so that its first phase is not missed
+        self.connection = connect_db()
+        self.connection.autocommit = True
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        super().start()
+
+    def run(self):
+        cursor = self.connection.cursor()
+        while True:
+            cursor.execute(PROGRESS_SQL, {"pid": self.pid})
+            elapsed = time.perf_counter() - self.start_time
+            for row in cursor.fetchall():
+                self.samples.append((elapsed, *row))
+            if self._stop_event.wait(self.interval):
+                break
+        self.connection.close()
+
+    def stop(self) -> List[PhaseTiming]:
+        end_time = time.perf_counter()
+        self._stop_event.set()
+        self.join()
+        return summarize_phases(self.samples, end_time - self.start_time)
+
+
+def summarize_phases(samples: List[tuple], total_time: float) -> List[PhaseTiming]:
+    # a phase lasts from its first sample to the first sample of the next phase, its
+    # progress is measured between its own first and last samples as some counters
+    # restart at each phase. index_vacuum_count stays cumulative: the number of index
+    # passes completed when the phase ends
+    phases = []
+    last_counters = None
+    for elapsed, command, phase, *counters in samples:
+        if phases and (command, phase) == (phases[-1]["command"], phases[-1]["phase"]):
+            last_counters = counters
+            continue
+        if phases:
+            close_phase(phases[-1], elapsed, last_counters)
+        phases.append(
+            {
+                "command": command,
+                "phase": phase,
+                "start": elapsed,
+                **dict(zip(PROGRESS_COUNTERS, counters)),
+            }
+        )
+        last_counters = counters
+    if phases:
+        close_phase(phases[-1], total_time, last_counters)
+    return phases
+
+
+def close_phase(phase: dict, end: float, last_counters: List[int]):
+    phase["duration"] = end - phase["start"]
+    for counter, value in zip(PROGRESS_COUNTERS, last_counters):
+        if counter == "index_vacuum_count":
+            phase[counter] = value
+        else:
+            phase[counter] = max(value - phase[counter], 0)
+    blocks = max(
+        phase["heap_blks_scanned"], phase["heap_blks_vacuumed"], phase["blocks_done"]
+    )
+    phase["blocks_per_second"] = (
+        blocks / phase["duration"] if blocks and phase["duration"] else None
+    )
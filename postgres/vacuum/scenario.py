@@ -0,0 +1,287 @@
+import time
+from typing import List, Literal, Optional, TypedDict
+
+from common import capture_index_size, capture_table_size, connect_db, print_log
+from inspection import Inspection, create_extensions, inspect_relation
+from progress import PhaseTiming, ProgressMonitor
+
+
+# commands reported by pg_stat_progress_vacuum or pg_stat_progress_create_index
+MONITORED_STEPS = ["index", "vacuum", "reindex", "rewrite"]
+
+
+class Step(TypedDict, total=False):
+    kind: Literal[
+        "create",
+        "insert",
+        "index",
+        "delete",
+        "update",
+        "vacuum",
+        "reindex",
+        "rewrite",
+        "measure",
+        "set",
+    ]
+    # create
+    autovacuum: bool
+    nb_columns: int
+    # index
+    column: str
+    # insert
+    start: int
+    end: int
+    batch_size: int
+    # delete / update
+    where: str
+    set_clause: str
+    # vacuum
+    options: str
+    # reindex
+    concurrently: bool
+    # measure
+    label: str
+    target: Literal["table", "index"]
+    # set
+    setting: str
+    value: str
+
+
+class StepTiming(TypedDict):
+    step: int
+    kind: str
+    exec_time: float
+    nb_rows: int
+    phases: List[PhaseTiming]
+
+
+class ScenarioResult(TypedDict):
+    measures: dict
+    timings: List[StepTiming]
+    inspections: List[Inspection]
+
+
+def create_step(autovacuum: bool = False, nb_columns: int = 0) -> Step:
+    return {"kind": "create", "autovacuum": autovacuum, "nb_columns": nb_columns}
+
+
+def insert_step(start: int, end: int, batch_size: int = 10_000_000) -> Step:
+    return {"kind": "insert", "start": start, "end": end, "batch_size": batch_size}
+
+
+def index_step(column: str = "id") -> Step:
+    return {"kind": "index", "column": column}
+
+
+def delete_step(where: str) -> Step:
+    return {"kind": "delete", "where": where}
+
+
+def update_step(set_clause: str, where: str) -> Step:
+    return {"kind": "update", "set_clause": set_clause, "where": where}
+
+
+def vacuum_step(options: Optional[str] = None) -> Step:
+    return {"kind": "vacuum", "options": options}
+
+
+def reindex_step(concurrently: bool = False) -> Step:
+    return {"kind": "reindex", "concurrently": concurrently}
+
+
+def rewrite_step() -> Step:
+    return {"kind": "rewrite"}
+
+
+def measure_step(label: str, target: Literal["table", "index"] = "table") -> Step:
+    return {"kind": "measure", "label": label, "target": target}
+
+
+def set_step(setting: str, value: str) -> Step:
+    return {"kind": "set", "setting": setting, "value": value}
+
+
+def ranges_predicate(ranges: List[tuple]) -> str:
+    return " OR ".join(f"(id >= {start} AND id <= {end})" for start, end in ranges)
+
+
+def run_create(cursor, table_name: str, step: Step):
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+    # extra columns c1..cN take random values, so that inserts only list id and the
+    # indexes built on them are filled in random order
+    columns = "".join(
+        f", c{i} int8 DEFAULT (random() * 1e12)::int8"
+        for i in range(1, step.get("nb_columns", 0) + 1)
+    )
+    cursor.execute(f"CREATE TABLE {table_name} (id int8{columns});")
+    cursor.execute(
+        f"ALTER TABLE {table_name} SET (autovacuum_enabled = {str(step.get('autovacuum', False)).lower()});"
+    )
+    return 0
+
+
+def run_insert(cursor, table_name: str, step: Step):
+    # batches keep each transaction and its WAL bounded on tables of hundreds of millions of rows
+    nb_rows = 0
+    batch_size = step.get("batch_size", 10_000_000)
+    for batch_start in range(step["start"], step["end"] + 1, batch_size):
+        batch_end = min(batch_start + batch_size - 1, step["end"])
+        cursor.execute(
+            f"INSERT INTO {table_name} (id) (SELECT * FROM GENERATE_SERIES({batch_start}, {batch_end}));"
+        )
+        nb_rows += cursor.rowcount
+    return nb_rows
+
+
+def run_index(cursor, table_name: str, step: Step):
+    cursor.execute(
+        f"CREATE INDEX ON {table_name} USING BTREE({step.get('column', 'id')});"
+    )
+    return 0
+
+
+def run_delete(cursor, table_name: str, step: Step):
+    cursor.execute(f"DELETE FROM {table_name} WHERE {step['where']};")
+    return cursor.rowcount
+
+
+def run_update(cursor, table_name: str, step: Step):
+    cursor.execute(
+        f"UPDATE {table_name} SET {step['set_clause']} WHERE {step['where']};"
+    )
+    return cursor.rowcount
+
+
+def run_vacuum(cursor, table_name: str, step: Step):
+    options = f"({step['options']}) " if step.get("options") else ""
+    cursor.execute(f"VACUUM {options}{table_name};")
+    return 0
+
+
+def run_reindex(cursor, table_name: str, step: Step):
+    concurrently = "CONCURRENTLY " if step.get("concurrently") else ""
+    cursor.execute(f"REINDEX TABLE {concurrently}{table_name};")
+    return 0
+
+
+def run_rewrite(cursor, table_name: str, step: Step):
+    # pg_repack-style: copy the live rows into a new table, then swap it in place of
+    # the old one in a short transaction. LIKE ... INCLUDING ALL recreates the indexes
+    # with their primary key / unique constraints in any schema, so they are built
+    # before the copy and maintained by it
+    new_table_name = f"{table_name}_rewrite"
+    index_names_sql = """SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+        quote_ident(c.relname) FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE i.indrelid = %s::regclass ORDER BY i.indexrelid"""
+    cursor.execute(index_names_sql, (table_name,))
+    index_names = [row[1] for row in cursor.fetchall()]
+    cursor.execute(
+        f"SELECT reloptions FROM pg_class WHERE oid = '{table_name}'::regclass"
+    )
+    reloptions = cursor.fetchone()[0]
+
+    storage_parameters = f" WITH ({', '.join(reloptions)})" if reloptions else ""
+    cursor.execute(f"DROP TABLE IF EXISTS {new_table_name};")
+    cursor.execute(
+        f"CREATE TABLE {new_table_name} (LIKE {table_name} INCLUDING ALL){storage_parameters};"
+    )
+    cursor.execute(f"INSERT INTO {new_table_name} SELECT * FROM {table_name};")
+    nb_rows = cursor.rowcount
+    # LIKE clones the indexes in the order of their oids, the copies are renamed
+    # after the originals once those are dropped
+    cursor.execute(index_names_sql, (new_table_name,))
+    new_index_names = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("BEGIN;")
+    cursor.execute(f"DROP TABLE {table_name};")
+    # RENAME TO takes the bare name, table_name may be schema qualified
+    cursor.execute(
+        f"ALTER TABLE {new_table_name} RENAME TO {table_name.split('.')[-1]};"
+    )
+    for index_name, new_index_name in zip(index_names, new_index_names):
+        cursor.execute(f"ALTER INDEX {new_index_name} RENAME TO {index_name};")
+    cursor.execute("COMMIT;")
+    return nb_rows
+
+
+def run_set(cursor, table_name: str, step: Step):
+    cursor.execute(f"SET {step['setting']} = '{step['value']}';")
+    return 0
+
+
+STEP_FUNCTIONS = {
+    "create": run_create,
+    "insert": run_insert,
+    "index": run_index,
+    "delete": run_delete,
+    "update": run_update,
+    "vacuum": run_vacuum,
+    "reindex": run_reindex,
+    "rewrite": run_rewrite,
+    "set": run_set,
+}
+
+
+def run_scenario(
+    steps: List[Step],
+    table_name: str = "test",
+    progress_interval: Optional[float] = 0.05,
+    inspect: Optional[bool] = False,
+    approximate_above: Optional[int] = 1024,
+) -> ScenarioResult:
+    # every statement runs in autocommit, which VACUUM and REINDEX CONCURRENTLY require
+    connection = connect_db()
+    connection.set_isolation_level(0)
+    cursor = connection.cursor()
+    measures = {}
+    timings = []
+    inspections = []
+    if inspect:
+        create_extensions(cursor)
+
+    for i, step in enumerate(steps):
+        if step["kind"] == "measure":
+            if step.get("target", "table") == "index":
+                measures[step["label"]] = capture_index_size(cursor, table_name)
+                print_log(f"Index size {step['label']}: {measures[step['label']]}")
+            else:
+                measures[step["label"]] = capture_table_size(cursor, table_name)
+                print_log(f"Table size {step['label']}: {measures[step['label']]}")
+            continue
+
+        monitor = None
+        if progress_interval and step["kind"] in MONITORED_STEPS:
+            monitor = ProgressMonitor(connection.get_backend_pid(), progress_interval)
+            monitor.start()
+        start = time.perf_counter()
+        nb_rows = STEP_FUNCTIONS[step["kind"]](cursor, table_name, step)
+        exec_time = time.perf_counter() - start
+        phases = monitor.stop() if monitor else []
+        timings.append(
+            {
+                "step": i,
+                "kind": step["kind"],
+                "exec_time": exec_time,
+                "nb_rows": nb_rows,
+                "phases": phases,
+            }
+        )
+        print_log(f"Step {i} {step['kind']}: {exec_time:.3f}s, {nb_rows} rows")
+        for phase in phases:
+            print_log(
+                f"    {phase['command']} {phase['phase']}: {phase['duration']:.3f}s"
+                + (
+                    f", {phase['blocks_per_second']:.0f} blocks/s"
+                    if phase["blocks_per_second"]
+                    else ""
+                )
+            )
+        if inspect:
+            inspections.append(
+                inspect_relation(cursor, table_name, i, step["kind"], approximate_above)
+            )
+
+    connection.close()
+    return {"measures": measures, "timings": timings, "inspections": inspections}